@@ -0,0 +1,329 @@
+"""Benchmarks of skrob on the local fixtures.
+
+Run from the repository's root, e.g.:
+
+    python -m benchmarks                       # Run all and print the results.
+    python -m benchmarks --save baseline.json  # Also save them as a baseline.
+    python -m benchmarks --compare baseline.json
+
+The last compares the results with the baseline's, and exits with status 1 if any got worse by
+more than --tolerance. Each benchmark runs in a process of its own, so that their peak memory
+usages are told apart.
+"""
+
+from .fixtures import Fixtures, add_arguments, options
+from skrob import Skrob, CssSelect, XpathSelect, JmespathSelect, Document, JsonDocument
+from argparse import ArgumentParser, SUPPRESS
+from dataclasses import dataclass
+import importlib.metadata
+import statistics
+import subprocess
+import platform
+import skrob.cli
+import asyncio
+import json
+import time
+import sys
+import os
+
+forum_topics = """
+{
+    .topictitle::attr(href) -> {
+        .content;
+        a[rel='next']::attr(href) ->
+    } !;
+    a[rel='next']::attr(href) ->
+} !;
+"""
+
+
+@dataclass
+class Crawl:
+    """Run of code on the fixture at path, through skrob.cli.run() with the options in argv if
+    given, or else through Skrob.run()"""
+
+    name: str
+    code: str
+    path: str
+    argv: list = None
+
+    def measure(self, base_url):
+        output = LineCounter()
+        urls = LineCounter()
+        url = base_url + self.path
+        started = time.perf_counter()
+
+        if self.argv is None:
+            bcfs = Skrob(self.code, output, urls, flush_interval=None)
+            asyncio.run(bcfs.run([url]))
+        else:
+            argv = ["skrob", "--line-buffered"] + self.argv + [self.code, url]
+            skrob.cli.run(argv, output, urls)
+
+        seconds = time.perf_counter() - started
+        return {
+            "seconds": seconds,
+            "pages": urls.lines,
+            "pages_per_second": urls.lines / seconds,
+            "results": output.lines,
+            "first_result_seconds": (output.first or time.perf_counter()) - started,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+@dataclass
+class Selection:
+    """Selecting with select from a generated document, parsed anew each time, for at least
+    duration seconds"""
+
+    name: str
+    select: object
+    document: object
+    duration: float = 2.0
+
+    def measure(self, base_url):
+        fixtures = Fixtures(rows=5000, page_size=1000)
+        text, document_type = self.document(fixtures)
+        documents = 0
+        selected = 0
+        started = time.perf_counter()
+
+        while time.perf_counter() - started < self.duration:
+            selected += len(self.select.select(document_type(text)))
+            documents += 1
+
+        seconds = time.perf_counter() - started
+        return {
+            "documents_per_second": documents / seconds,
+            "megabytes_per_second": documents * len(text.encode()) / seconds / 1e6,
+            "results": selected // documents,
+            "peak_rss_mb": peak_rss_mb(),
+        }
+
+
+def html_table(fixtures):
+    return fixtures.table(), Document
+
+
+def json_items(fixtures):
+    return json.dumps(fixtures.api_items(1)), lambda text: JsonDocument(text, page=True)
+
+
+benchmarks = [
+    Crawl("forum", "{ .content; a[rel='next']::attr(href) -> } !;", "/forum/1"),
+    Crawl("forum_topics", forum_topics, "/forum/1"),
+    Crawl("tree", "{ .leaf; a.child::attr(href) -> } !;", "/tree/0"),
+    Crawl("json_api", "{ &items[].title&; &next& -> } !;", "/api/items?page=1"),
+    Crawl("cli_forum_topics", forum_topics, "/forum/1", []),
+    Crawl("cli_table", "td.name::text;", "/table", []),
+    Crawl("cli_table_stream", "td.name::text;", "/table", ["--stream"]),
+    Selection("css_table", CssSelect("td.name::text"), html_table),
+    Selection("xpath_table", XpathSelect("//td[@class='name']/text()"), html_table),
+    Selection("css_json", CssSelect("items item title::text"), json_items),
+    Selection("jmespath_json", JmespathSelect("items[].title"), json_items),
+]
+
+# Metrics that are better the higher they are. Others are better the lower, except for counts,
+# which are to stay the same.
+higher_is_better = {"pages_per_second", "documents_per_second", "megabytes_per_second"}
+counts = {"pages", "results"}
+
+
+class LineCounter:
+    def __init__(self):
+        self.lines = 0
+        self.first = None
+
+    def write(self, text):
+        if self.first is None:
+            self.first = time.perf_counter()
+
+        self.lines += text.count("\n")
+
+    def flush(self):
+        pass
+
+
+def peak_rss_mb():
+    # Not available on Windows.
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # In bytes on macOS, in kilobytes elsewhere.
+    return peak / (1 << 20) if sys.platform == "darwin" else peak / (1 << 10)
+
+
+def run_benchmark(name, base_url):
+    """Run a benchmark in a process of its own, and return its metrics."""
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks", "--child", name, "--base-url", base_url],
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    return json.loads(output)
+
+
+def run_all(names, base_url, repeat):
+    """Return the median of each metric of repeat runs of each benchmark."""
+    results = {}
+
+    for benchmark in benchmarks:
+        if names and benchmark.name not in names:
+            continue
+
+        runs = [run_benchmark(benchmark.name, base_url) for _ in range(repeat)]
+        results[benchmark.name] = {
+            metric: statistics.median(run[metric] for run in runs) for metric in runs[0]
+        }
+        print_metrics(benchmark.name, results[benchmark.name])
+
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """Print how the results differ from the baseline's, and return whether any regressed."""
+    regressed = False
+
+    for name, metrics in results.items():
+        for metric, value in metrics.items():
+            base = baseline.get(name, {}).get(metric)
+
+            if base is None:
+                continue
+
+            change = (value - base) / base if base else 0.0
+
+            if metric in counts:
+                worse = value != base
+            elif metric in higher_is_better:
+                worse = change < -tolerance
+            else:
+                worse = change > tolerance
+
+            regressed = regressed or worse
+            print(
+                f"{name:20} {metric:24} {value:12.3f} {base:12.3f} {change:+8.1%}"
+                + ("  REGRESSED" if worse else "")
+            )
+
+    return regressed
+
+
+def print_metrics(name, metrics):
+    for metric, value in metrics.items():
+        print(f"{name:20} {metric:24} {value:12.3f}", flush=True)
+
+
+def start_server(args):
+    argv = [sys.executable, "-m", "benchmarks.fixtures"]
+
+    for option in options:
+        argv += [f"--{option}", str(getattr(args, option))]
+
+    server = subprocess.Popen(
+        argv,
+        cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    port = int(server.stdout.readline())
+    return server, f"http://127.0.0.1:{port}"
+
+
+def build_parser():
+    parser = ArgumentParser(
+        prog="python -m benchmarks", description="Benchmark skrob on local fixtures"
+    )
+    parser.add_argument(
+        "names",
+        metavar="NAME",
+        nargs="*",
+        help="Benchmarks to run, all by default: "
+        + ", ".join(benchmark.name for benchmark in benchmarks),
+    )
+    parser.add_argument(
+        "--repeat",
+        metavar="N",
+        dest="repeat",
+        default="3",
+        type=int,
+        help="Number of runs of each benchmark, of which the median of each metric is taken (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--save",
+        metavar="FILE",
+        dest="save",
+        help="Save the results as a baseline to FILE",
+    )
+    parser.add_argument(
+        "--compare",
+        metavar="FILE",
+        dest="compare",
+        help="Compare the results with the baseline saved to FILE",
+    )
+    parser.add_argument(
+        "--tolerance",
+        metavar="FRACTION",
+        dest="tolerance",
+        default="0.1",
+        type=float,
+        help="Relative change of a metric for the worse above which it counts as a regression (default: %(default)s)",
+    )
+    # Used to run a single benchmark in a process of its own.
+    parser.add_argument("--child", dest="child", help=SUPPRESS)
+    parser.add_argument("--base-url", dest="base_url", help=SUPPRESS)
+    add_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+
+    if args.child:
+        benchmark = next(b for b in benchmarks if b.name == args.child)
+        print(json.dumps(benchmark.measure(args.base_url)))
+        return 0
+
+    settings = {option: getattr(args, option) for option in options}
+    baseline = None
+
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+
+        if baseline["settings"] != settings:
+            print(
+                f"Warning: {args.compare} was saved with different settings",
+                file=sys.stderr,
+            )
+
+    server, base_url = start_server(args)
+
+    try:
+        results = run_all(args.names, base_url, args.repeat)
+    finally:
+        server.terminate()
+        server.wait()
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(
+                {
+                    "version": importlib.metadata.version("skrob"),
+                    "python": platform.python_version(),
+                    "settings": settings,
+                    "results": results,
+                },
+                file,
+                indent=4,
+            )
+
+    if baseline:
+        print()
+        print(f"{'':20} {'':24} {'current':>12} {'baseline':>12} {'change':>8}")
+
+        if compare(results, baseline["results"], args.tolerance):
+            return 1
+
+    return 0
@@ -0,0 +1,269 @@
+"""Local HTTP server of synthetic sites to benchmark skrob on"""
+
+from argparse import ArgumentParser
+from aiohttp import web
+import asyncio
+import zlib
+
+
+class Fixtures:
+    """Generator of the synthetic sites' pages.
+
+    - /forum/N: page N of pages of a forum, with posts topics linked to topics of topic_pages
+      pages each, at /topic/T/N.
+    - /tree/P: node at path P, e.g. 0.3.1, of a tree of depth levels with branching links per
+      node.
+    - /table: a single page with a table of rows rows.
+    - /api/items?page=N: page N of a JSON API of items, page_size per page, linking to the next.
+
+    Each response is delayed by up to latency seconds, by an amount that depends only on its path,
+    so that runs are comparable with each other. Posts and items have text of text_size
+    characters.
+    """
+
+    def __init__(
+        self,
+        latency=0.0,
+        pages=50,
+        posts=20,
+        topic_pages=3,
+        depth=4,
+        branching=4,
+        rows=20000,
+        items=2000,
+        page_size=50,
+        text_size=200,
+    ):
+        self.latency = latency
+        self.pages = pages
+        self.posts = posts
+        self.topic_pages = topic_pages
+        self.depth = depth
+        self.branching = branching
+        self.rows = rows
+        self.items = items
+        self.page_size = page_size
+        self.text_size = text_size
+
+    def app(self):
+        app = web.Application()
+        app.router.add_get(
+            "/forum/{page}",
+            self._html(lambda request: self.forum(int(request.match_info["page"]))),
+        )
+        app.router.add_get(
+            "/topic/{topic}/{page}",
+            self._html(
+                lambda request: self.topic(
+                    int(request.match_info["topic"]), int(request.match_info["page"])
+                )
+            ),
+        )
+        app.router.add_get(
+            "/tree/{path}",
+            self._html(lambda request: self.tree(request.match_info["path"])),
+        )
+        app.router.add_get("/table", self._html(lambda request: self.table()))
+        app.router.add_get(
+            "/api/items",
+            self._json(lambda request: self.api_items(int(request.query["page"]))),
+        )
+        return app
+
+    def forum(self, page):
+        posts = []
+
+        for i in range(self.posts):
+            topic = page * self.posts + i
+            posts.append(
+                f'<div class="post"><a class="topictitle" href="/topic/{topic}/1">'
+                f'Topic {topic}</a><div class="content">{self.text(topic)}</div></div>'
+            )
+
+        if page < self.pages:
+            posts.append(f'<a rel="next" href="/forum/{page + 1}">Next</a>')
+
+        return self.page(f"Forum, page {page}", posts)
+
+    def topic(self, topic, page):
+        posts = [
+            f'<div class="post"><div class="content">{self.text(topic + i)}</div></div>'
+            for i in range(self.posts)
+        ]
+
+        if page < self.topic_pages:
+            posts.append(f'<a rel="next" href="/topic/{topic}/{page + 1}">Next</a>')
+
+        return self.page(f"Topic {topic}, page {page}", posts)
+
+    def tree(self, path):
+        nodes = [f'<p class="leaf">{self.text(len(path))}</p>']
+
+        if path.count(".") < self.depth:
+            nodes += [
+                f'<a class="child" href="/tree/{path}.{i}">Node {path}.{i}</a>'
+                for i in range(self.branching)
+            ]
+
+        return self.page(f"Node {path}", nodes)
+
+    def table(self):
+        rows = "".join(
+            f'<tr><td class="id">{i}</td><td class="name">Row {i}</td>'
+            f'<td><a href="/row/{i}">{self.text(i)[:40]}</a></td></tr>'
+            for i in range(self.rows)
+        )
+        return self.page("Table", [f'<table class="rows">{rows}</table>'])
+
+    def api_items(self, page):
+        start = (page - 1) * self.page_size
+        end = min(start + self.page_size, self.items)
+        items = [
+            {"id": i, "title": f"Item {i}", "body": self.text(i)}
+            for i in range(start, end)
+        ]
+        result = {"page": page, "items": items}
+
+        if end < self.items:
+            result["next"] = f"/api/items?page={page + 1}"
+
+        return result
+
+    def page(self, title, parts):
+        body = "\n".join(parts)
+        return (
+            f"<!DOCTYPE html><html><head><title>{title}</title></head>"
+            f"<body><h1>{title}</h1>\n{body}\n</body></html>"
+        )
+
+    def text(self, seed):
+        words = ("lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing")
+        text = " ".join(words[(seed + i) % len(words)] for i in range(self.text_size))
+        return text[: self.text_size]
+
+    def delay(self, request):
+        return self.latency * (zlib.crc32(request.path_qs.encode()) % 1000) / 999
+
+    def _html(self, generate):
+        async def handler(request):
+            await asyncio.sleep(self.delay(request))
+            return web.Response(text=generate(request), content_type="text/html")
+
+        return handler
+
+    def _json(self, generate):
+        async def handler(request):
+            await asyncio.sleep(self.delay(request))
+            return web.json_response(generate(request))
+
+        return handler
+
+
+async def serve(fixtures, host="127.0.0.1", port=0):
+    """Start serving the fixtures, and return the runner to clean up and the port served on."""
+    runner = web.AppRunner(fixtures.app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    return runner, runner.addresses[0][1]
+
+
+def add_arguments(parser):
+    defaults = Fixtures()
+    parser.add_argument(
+        "--latency",
+        metavar="SECONDS",
+        dest="latency",
+        default=defaults.latency,
+        type=float,
+        help="Maximum delay of each response. Can be fractional (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--pages",
+        metavar="N",
+        dest="pages",
+        default=defaults.pages,
+        type=int,
+        help="Number of forum pages (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--posts",
+        metavar="N",
+        dest="posts",
+        default=defaults.posts,
+        type=int,
+        help="Number of posts per forum and topic page (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--depth",
+        metavar="N",
+        dest="depth",
+        default=defaults.depth,
+        type=int,
+        help="Depth of the link tree (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--branching",
+        metavar="N",
+        dest="branching",
+        default=defaults.branching,
+        type=int,
+        help="Number of links per node of the link tree (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--rows",
+        metavar="N",
+        dest="rows",
+        default=defaults.rows,
+        type=int,
+        help="Number of rows of the table (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--items",
+        metavar="N",
+        dest="items",
+        default=defaults.items,
+        type=int,
+        help="Number of items of the JSON API (default: %(default)s)",
+    )
+
+
+# Fixtures' settings that add_arguments() adds options for.
+options = ("latency", "pages", "posts", "depth", "branching", "rows", "items")
+
+
+def fixtures_from(args):
+    return Fixtures(**{option: getattr(args, option) for option in options})
+
+
+def main():
+    parser = ArgumentParser(description="Serve the benchmark fixtures")
+    parser.add_argument(
+        "--port",
+        metavar="PORT",
+        dest="port",
+        default="0",
+        type=int,
+        help="Port to listen on, 0 for any free one (default: %(default)s)",
+    )
+    add_arguments(parser)
+    args = parser.parse_args()
+
+    async def run():
+        runner, port = await serve(fixtures_from(args), port=args.port)
+        # The port is the first line, for whoever started the server to read.
+        print(port, flush=True)
+
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await runner.cleanup()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -1,4 +1,27 @@
-from .bcfs import *
-from .skrob import *
+import importlib
 
-__all__ = ["Context", "Block", "Collect", "Follow", "Select", "SkrobCore", "XpathSelect", "CssSelect", "Skrob"]
+__all__ = ["Context", "Document", "JsonDocument", "Block", "Collect", "Follow", "Select", "SkrobCore", "XpathSelect", "CssSelect", "JmespathSelect", "Skrob"]
+
+# The modules that the names are from, imported on first use, as importing them takes long, which
+# e.g. the command line's help doesn't have to wait for.
+_modules = {
+    "Context": ".bcfs",
+    "Block": ".bcfs",
+    "Collect": ".bcfs",
+    "Follow": ".bcfs",
+    "Select": ".bcfs",
+    "Document": ".skrob",
+    "JsonDocument": ".skrob",
+    "SkrobCore": ".skrob",
+    "XpathSelect": ".skrob",
+    "CssSelect": ".skrob",
+    "JmespathSelect": ".skrob",
+    "Skrob": ".skrob",
+}
+
+
+def __getattr__(name):
+    if name not in _modules:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+    return getattr(importlib.import_module(_modules[name], __name__), name)
@@ -0,0 +1,149 @@
+from contextlib import suppress
+import threading
+import asyncio
+import json
+import os
+
+
+class Disconnected(Exception):
+    """The connection that jobs came from was lost, so there is no one to write their output to"""
+
+
+class Batch:
+    """Runner of jobs, each a script to run on a list of URLs, concurrently over one shared session.
+
+    Jobs are read as JSON lines like {"id": "a", "code": "...", "urls": ["..."]}, where id defaults
+    to the job's line number, and urls may also be a single URL. Each job's output is written as JSON lines tagged with its id: one
+    {"id": ..., "text": "..."} per collected result, in order, then {"id": ..., "done": true,
+    "results": N} once it is done, or {"id": ..., "error": "..."} if it fails. The output of jobs
+    that run at the same time is interleaved.
+
+    new_skrob(code) returns the Skrob to run a job with. Each job is to get one with its own
+    visited URLs, so that jobs don't skip the URLs that other jobs have followed. At most max_jobs
+    jobs run at once, after which no more are read until one is done.
+    """
+
+    def __init__(self, new_skrob, max_jobs=8, max_pending=100):
+        self._new_skrob = new_skrob
+        self._max_jobs = max_jobs
+        self._max_pending = max_pending
+        self._job_slots = None
+
+    async def run(self, session, input_stream, output_stream):
+        """Run the jobs read from input_stream, writing their output to output_stream, until the
+        input ends and all jobs are done."""
+        loop = asyncio.get_running_loop()
+        lines = asyncio.Queue()
+
+        def read():
+            # Ends with an empty line, as readline() does.
+            with suppress(RuntimeError):
+                for line in input_stream:
+                    loop.call_soon_threadsafe(lines.put_nowait, line)
+
+                loop.call_soon_threadsafe(lines.put_nowait, "")
+
+        async def write(line):
+            output_stream.write(line)
+
+        # Reading a file may block. The thread is a daemon, so that it doesn't keep the process
+        # alive while waiting for input that is no longer needed.
+        threading.Thread(target=read, daemon=True).start()
+        self._job_slots = asyncio.Semaphore(self._max_jobs)
+
+        try:
+            await self._run_jobs(session, lines.get, write)
+        finally:
+            output_stream.flush()
+
+    async def serve(self, session, path):
+        """Run the jobs read from each connection to a Unix socket at path, writing their output
+        back to the connection, until cancelled."""
+
+        async def handle(reader, writer):
+            async def read_line():
+                return (await reader.readline()).decode()
+
+            async def write(line):
+                try:
+                    writer.write(line.encode())
+                    await writer.drain()
+                except ConnectionError as error:
+                    raise Disconnected from error
+
+            try:
+                await self._run_jobs(session, read_line, write)
+            except (ConnectionError, Disconnected):
+                pass
+            finally:
+                writer.close()
+
+        self._job_slots = asyncio.Semaphore(self._max_jobs)
+        # Jobs with many URLs make for long lines.
+        server = await asyncio.start_unix_server(handle, path, limit=1 << 24)
+
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            with suppress(FileNotFoundError):
+                os.remove(path)
+
+    async def _run_jobs(self, session, read_line, write):
+        tasks = set()
+        number = 0
+
+        try:
+            while True:
+                line = await read_line()
+
+                if not line:
+                    break
+
+                number += 1
+
+                if not line.strip():
+                    continue
+
+                await self._job_slots.acquire()
+                task = asyncio.create_task(self._run_job(session, line, number, write))
+                task.add_done_callback(lambda task: self._job_slots.release())
+                task.add_done_callback(tasks.discard)
+                tasks.add(task)
+
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def _run_job(self, session, line, number, write):
+        job_id = number
+        results = 0
+
+        try:
+            job = json.loads(line)
+            job_id = job.get("id", number)
+            skrob = self._new_skrob(job["code"])
+            urls = job["urls"]
+
+            # A single URL is taken as is, not as a list of its characters.
+            if isinstance(urls, str):
+                urls = [urls]
+            elif not isinstance(urls, list):
+                raise TypeError(f"urls must be a list of URLs, not {urls!r}")
+
+            async for context in skrob.iter(
+                urls, session=session, max_pending=self._max_pending
+            ):
+                await write(to_line({"id": job_id, "text": context.text}))
+                results += 1
+        except Disconnected:
+            raise
+        except Exception as error:
+            await write(to_line({"id": job_id, "error": repr(error)}))
+        else:
+            await write(to_line({"id": job_id, "done": True, "results": results}))
+
+
+def to_line(value):
+    return json.dumps(value, ensure_ascii=False) + "\n"
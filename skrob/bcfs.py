@@ -1,7 +1,15 @@
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 from abc import ABC, abstractmethod
 from asyncio import Queue
+from contextlib import suppress
+from contextvars import ContextVar
+from .budget import Budget
+from .visited import VisitedSet
+from .stats import current_stats
+import hashlib
 import asyncio
+import time
+import zlib
 
 
 def flatten(it):
@@ -16,10 +24,32 @@ def iflatten(it):
             yield e
 
 
+def flatten_once(it):
+    return [e for sublist in it for e in sublist]
+
+
+async def resolved(value):
+    return value
+
+
+async def cancel_all(tasks):
+    """Cancel the tasks and wait for them to end, so that none is left running."""
+    tasks = list(tasks)
+
+    for task in tasks:
+        task.cancel()
+
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
 @dataclass
 class Context:
     locator: str
-    text: str
+    document: object
+
+    @property
+    def text(self):
+        return str(self.document)
 
 
 @dataclass
@@ -37,74 +67,487 @@ class Follow:
     pass
 
 
+@dataclass
+class Lane:
+    """Progress of one top-level context through the top-level commands up to the next Collect,
+    ending before end. Checkpoints are taken before and after each top-level Block iteration.
+    """
+
+    end: int
+    checkpoints: list = field(default_factory=list)
+
+
+@dataclass
+class Checkpoint:
+    """Contexts to resume a lane on, from position.
+
+    A checkpoint is pending until the lane has moved past it and all Collects started after it
+    have finished. The locators visited meanwhile are followed again when resuming from it.
+    """
+
+    lane: Lane
+    position: int
+    contexts: list
+    visited: set = field(default_factory=set)
+    pending: int = 1
+
+
+current_checkpoint = ContextVar("current_checkpoint", default=None)
+
+
 @dataclass
 class Select(ABC):
     query: str
 
     @abstractmethod
-    def select(self, text):
+    def select(self, document):
         raise NotImplementedError
 
+    def __getstate__(self):
+        # Only the query is pickled, e.g. to be sent to worker processes, and compiled again on
+        # the other side, as compiled queries can't be pickled.
+        return {"query": self.query}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+
+def select_all(selector, documents):
+    return [selector.select(document) for document in documents]
+
 
 """Abstract interpreter of the BCFS (Block-Collect-Follow-Select) abstract scripting language"""
 
 
 class Bcfs(ABC):
-    def __init__(self, code):
+    # Number of documents sent to the executor at once.
+    select_batch_size = 64
+    # Seconds between checks of the frontier for work in distributed runs.
+    frontier_poll_interval = 0.1
+
+    def __init__(
+        self,
+        code,
+        max_follows=None,
+        ordered=True,
+        state=None,
+        visited=None,
+        executor=None,
+        stats=None,
+        budget=None,
+    ):
         self._code = code
+        self._max_follows = max_follows
+        self._ordered = ordered
+        self._state = state
+        self._visited = visited or VisitedSet()
+        self._executor = executor
+        self._stats = stats
+        self._budget = budget or Budget()
+        self._followed = 0
+        self._collected = 0
+        self._out_of_budget = None
+        self._labels = {}
+        self._refollowed = set()
+
+        if stats:
+            # Registered up front, for the stats to list the commands in the script's order.
+            stats.command("initial ->")
+            self._label_commands(code)
+        self._follow_semaphore = None
+        self._results = None
+
+    async def iter(self, *args, max_pending=100, **kwargs):
+        """Run, yielding collected contexts instead of printing them.
+
+        At most max_pending contexts are held for the consumer. When that many are waiting, no new
+        pages are fetched until the consumer catches up."""
+
+        self._results = Queue(max_pending)
+        self._results_taken = asyncio.Condition()
+        done = object()
+
+        async def produce():
+            try:
+                await self.run(*args, **kwargs)
+            except Exception:
+                await self._results.put(done)
+                raise
+
+            await self._results.put(done)
+
+        task = asyncio.create_task(produce())
+
+        try:
+            while True:
+                context = await self._results.get()
+
+                async with self._results_taken:
+                    self._results_taken.notify_all()
+
+                if context is done:
+                    break
+
+                yield context
+
+            await task
+        finally:
+            if not task.done():
+                task.cancel()
+
+                with suppress(asyncio.CancelledError):
+                    await task
+
+            self._results = None
 
     @abstractmethod
     async def run(self, *args, **kwargs):
         raise NotImplementedError
 
-    async def _run_with_session(self, session, initial_contexts):
-        self._visited_locators = set()
-        self._bg_tasks = Queue()
+    def seed(self, frontier, locators, shards):
+        """Start a distributed run on the locators, by shards shards of workers sharing the
+        frontier, which is emptied first.
+
+        Each worker runs work() for its shard: it follows the locators whose shard keys hash to
+        it, and runs the script on the pages from where it followed them, leaving the locators it
+        comes across to their shards' workers. Its collected texts go to the frontier, for
+        print_results() to print. Unlike in run(), the texts are unordered, and each context that
+        a Block's iterations end at goes on after it, not only those reached through the most
+        iterations, as no worker knows how many iterations the others went through.
+        """
+        frontier.reset(self._script_id(), shards)
+        frontier.add(
+            (), [(locator, self._shard(locator, shards)) for locator in locators]
+        )
+
+    async def print_results(self, frontier):
+        """Print the texts that the workers of a distributed run collect, until they are done,
+        then tell them to stop."""
+        while True:
+            # Checked first, as texts are added by the same transactions that finish tasks.
+            empty = frontier.is_empty()
+
+            for text in frontier.pop_results():
+                self.print(text)
+
+            if empty:
+                frontier.finish()
+                self.flush()
+                return
+
+            await asyncio.sleep(self.frontier_poll_interval)
+
+    def shard_key(self, locator):
+        """Return what decides which shard of workers of a distributed run follows locator."""
+        return locator
+
+    def _shard(self, locator, shards):
+        return zlib.crc32(self.shard_key(locator).encode()) % shards
+
+    async def _run_with_session(self, session, initial_contexts, follow_initial=False):
+        self._followed = 0
+        self._collected = 0
+        self._out_of_budget = asyncio.Event()
+        run = self._run_script(session, initial_contexts, follow_initial)
+
+        if not self._budget.stops:
+            return await run
 
-        async def get_contexts():
-            return initial_contexts
+        task = asyncio.create_task(run)
+        out_of_budget = asyncio.create_task(self._out_of_budget.wait())
 
-        result = await self._execute_commands(session, get_contexts(), self._code)
+        try:
+            await asyncio.wait(
+                [task, out_of_budget],
+                timeout=self._budget.seconds,
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+        except BaseException:
+            task.cancel()
+            raise
+        finally:
+            out_of_budget.cancel()
 
-        while not self._bg_tasks.empty():
-            await (await self._bg_tasks.get())
+        if task.done():
+            return task.result()
+
+        # Stopped early, with what was collected so far.
+        task.cancel()
+
+        with suppress(asyncio.CancelledError):
+            await task
+
+        return None
+
+    async def _run_script(self, session, initial_contexts, follow_initial):
+        if self._stats:
+            current_stats.set(self._stats)
+
+        self._bg_tasks = set()
+        self._last_selection = None
+        self._lanes = []
+        resumed_lanes = None
+        state = self._state and self._state.load(self._script_id())
+
+        if state:
+            self._visited.load(state["visited"])
+            self._refollowed = set(state["refollowed"])
+            resumed_lanes = [self._load_lane(lane) for lane in state["lanes"]]
+        else:
+            self._visited.clear()
+
+        # Position of the first command not run yet, and the groups of contexts to run from it,
+        # each run separately.
+        start = 0
+        groups = [[context] for context in initial_contexts]
+
+        try:
+            if resumed_lanes is None and follow_initial:
+                select = None
+
+                # Commands after a Collect run on the pages again, which then have to be kept
+                # whole.
+                if (
+                    len(self._code) > 1
+                    and isinstance(self._code[0], Select)
+                    and not any(isinstance(c, Collect) for c in self._code[1:-1])
+                    and self.can_select_while_following(self._code[0])
+                ):
+                    select = self._code[0]
+                    start = 1
+
+                results = await self._follow_all(
+                    session, resolved(initial_contexts), select
+                )
+                # What was selected from a page while following it is kept together, as if
+                # selected afterwards.
+                groups = [
+                    result if select else [result] for result in results if result
+                ]
+
+            if self._state:
+                result = await self._execute_lanes(
+                    session, groups, resumed_lanes, start
+                )
+            else:
+                result = await self._execute_groups(session, groups, self._code[start:])
+
+            while self._bg_tasks:
+                await asyncio.gather(*self._bg_tasks)
+        except BaseException:
+            if self._lanes:
+                self._save_state()
+
+            raise
+        finally:
+            await cancel_all(self._bg_tasks)
+            # Before the state is removed, which may take the store's files with it.
+            self._visited.close()
+
+        if self._state:
+            self._state.remove()
 
         if not isinstance(result, list):
             return await result
 
-    async def _execute_commands(self, session, get_contexts, commands):
+    async def _work_with_session(self, session, frontier, shard, shards, max_tasks):
+        frontier.check(self._script_id(), shards)
+        # Tasks taken by a previous worker of the shard that didn't finish them.
+        frontier.release(shard)
+        self._frontier = frontier
+        self._shards = shards
+        running = set()
+
+        try:
+            while True:
+                if len(running) < max_tasks:
+                    for id, position, locator in frontier.take(
+                        shard, max_tasks - len(running)
+                    ):
+                        running.add(
+                            asyncio.create_task(
+                                self._run_task(session, id, position, locator)
+                            )
+                        )
+
+                if running:
+                    done, running = await asyncio.wait(
+                        running,
+                        timeout=self.frontier_poll_interval,
+                        return_when=asyncio.FIRST_COMPLETED,
+                    )
+
+                    for task in done:
+                        task.result()
+                elif frontier.is_finished():
+                    return
+                else:
+                    await asyncio.sleep(self.frontier_poll_interval)
+        finally:
+            for task in running:
+                task.cancel()
+
+    async def _run_task(self, session, id, position, locator):
+        started = time.perf_counter()
+        result = await self.follow(session, locator)
+        follow = self._commands_at(position[:-1])[position[-1]] if position else None
+        self._record(follow, 1, int(result is not None), started)
+        texts = []
+
+        if result is not None:
+            self._resume(position, flatten([result]), texts)
+
+        self._frontier.done(id, texts)
+
+    async def _execute_lanes(self, session, groups, lanes=None, start=0):
+        if lanes is None:
+            lanes = []
+
+            for contexts in groups:
+                position = start
+
+                for i, command in enumerate(self._code[start:], start):
+                    if isinstance(command, Collect) or i == len(self._code) - 1:
+                        lanes.append((Lane(i + 1), position, contexts))
+                        position = i + 1
+
         tasks = []
+
+        for lane, position, contexts in lanes:
+            self._lanes.append(lane)
+            get_contexts = self._execute_chain(
+                session,
+                contexts,
+                self._code[position : lane.end],
+                self._start_lane(lane, position, contexts),
+                position,
+            )
+
+            if get_contexts:
+                tasks.append(asyncio.create_task(self._finish_lane(get_contexts)))
+
+        new_contexts = list(filter(None, flatten(await asyncio.gather(*tasks))))
+
+        if new_contexts:
+            return resolved(new_contexts)
+
+        return []
+
+    async def _start_lane(self, lane, position, contexts):
+        self._checkpoint(lane, position, contexts)
+        return contexts
+
+    async def _finish_lane(self, get_contexts):
         contexts = await get_contexts
+        self._release(current_checkpoint.get())
+        return contexts
 
-        for context in contexts:
+    def _checkpoint(self, lane, position, contexts):
+        previous = current_checkpoint.get()
+        checkpoint = Checkpoint(lane, position, contexts)
 
-            async def get_context(context):
-                return [context]
+        lane.checkpoints.append(checkpoint)
+        # Follows and Collects awaited from here on, including in tasks created from here, are
+        # accounted to this checkpoint.
+        current_checkpoint.set(checkpoint)
 
-            get_contexts = None
+        if previous:
+            self._release(previous)
 
-            for command in commands:
-                if isinstance(command, Block):
-                    get_contexts = self._execute_block(
-                        session, get_contexts or get_context(context), command
-                    )
-                elif isinstance(command, Collect):
-                    await self._bg_tasks.put(
-                        asyncio.create_task(
-                            self._print_texts(get_contexts or get_context(context))
-                        )
-                    )
-                    get_contexts = None
-                elif isinstance(command, Follow):
-                    get_contexts = self._follow_contexts(
-                        session, get_contexts or get_context(context)
-                    )
-                elif isinstance(command, Select):
-                    get_contexts = self._select_texts(
-                        get_contexts or get_context(context), command
-                    )
-                else:
-                    raise ValueError
+        if self._state.is_due():
+            self._save_state()
+
+    def _release_after(self, task, checkpoint):
+        # A failed Collect keeps its checkpoint pending, for a resumed run to repeat it.
+        if not task.cancelled() and task.exception() is None:
+            self._release(checkpoint)
+
+    def _release(self, checkpoint):
+        checkpoint.pending -= 1
+        checkpoints = checkpoint.lane.checkpoints
+
+        while checkpoints and not checkpoints[0].pending:
+            checkpoints.pop(0)
+
+    def _save_state(self):
+        checkpoints = [lane.checkpoints for lane in self._lanes if lane.checkpoints]
+        # Locators visited after the checkpoints that the lanes resume from, to be followed again
+        # on resume despite being in the visited store.
+        refollowed = set().union(
+            self._refollowed,
+            *(checkpoint.visited for checkpoint in flatten(checkpoints)),
+        )
+        lanes = [
+            {
+                "end": checkpoints[0].lane.end,
+                "position": checkpoints[0].position,
+                "contexts": [
+                    self.save_context(context) for context in checkpoints[0].contexts
+                ],
+            }
+            for checkpoints in checkpoints
+        ]
+
+        self._state.save(
+            self._script_id(), self._visited.dump(), list(refollowed), lanes
+        )
+
+    def _load_lane(self, lane):
+        contexts = [self.restore_context(*context) for context in lane["contexts"]]
+        return Lane(lane["end"]), lane["position"], contexts
+
+    def _label_commands(self, commands, prefix=""):
+        for i, command in enumerate(commands):
+            path = f"{prefix}{i}"
+
+            if isinstance(command, Block):
+                label = f"{path} {{}}"
+            elif isinstance(command, Collect):
+                label = f"{path} ;"
+            elif isinstance(command, Follow):
+                label = f"{path} ->"
+            else:
+                label = f"{path} {' '.join(command.query.split())}"
+
+            self._labels[id(command)] = label
+            self._stats.command(label)
+
+            if isinstance(command, Block):
+                self._label_commands(command.commands, path + ".")
+
+    def _record(self, command, contexts_in, contexts_out, started):
+        """Record a run of the command, or of following the initial locators if None, into the
+        stats."""
+        if not self._stats:
+            return
+
+        label = self._labels.get(id(command), "initial ->")
+        self._stats.command(label).record(
+            contexts_in, contexts_out, time.perf_counter() - started
+        )
+
+    def _script_id(self):
+        return hashlib.sha256(repr(self._code).encode()).hexdigest()
+
+    def save_context(self, context):
+        """Return a JSON-serializable list of arguments for restore_context() to recreate the
+        context from."""
+        return [context.locator, context.text]
+
+    def restore_context(self, locator, text):
+        return Context(locator, text)
+
+    async def _execute_commands(self, session, get_contexts, commands):
+        contexts = await get_contexts
+        return await self._execute_groups(
+            session, [[context] for context in contexts], commands
+        )
+
+    async def _execute_groups(self, session, groups, commands):
+        tasks = []
+
+        for contexts in groups:
+            get_contexts = self._execute_chain(session, contexts, commands)
 
             if get_contexts:
                 tasks.append(asyncio.create_task(get_contexts))
@@ -112,57 +555,470 @@ class Bcfs(ABC):
         new_contexts = list(filter(None, flatten(await asyncio.gather(*tasks))))
 
         if not new_contexts:
-            return contexts
+            return flatten(groups)
+
+        return resolved(new_contexts)
+
+    def _execute_chain(
+        self, session, contexts, commands, get_contexts=None, position=None
+    ):
+        """Chain the commands to run on the contexts, or on what get_contexts returns if given.
+        Commands after a Collect run on the contexts again. Return the chain's awaitable, or None
+        if the chain ended with a Collect.
+
+        Top-level commands of a lane start at position, and checkpoint around their Blocks.
+        """
+
+        fused = None
+
+        for i, command in enumerate(commands):
+            if i == fused:
+                continue
+
+            if isinstance(command, Block):
+                get_contexts = self._execute_block(
+                    session,
+                    get_contexts or resolved(contexts),
+                    command,
+                    None if position is None else position + i,
+                )
+            elif isinstance(command, Collect):
+                checkpoint = current_checkpoint.get()
+                task = asyncio.create_task(
+                    self._print_texts(
+                        get_contexts or resolved(contexts), position, command
+                    )
+                )
+                self._bg_tasks.add(task)
+                task.add_done_callback(self._forget_bg_task)
+                get_contexts = None
 
-        async def get_new_contexts(new_contexts):
-            return new_contexts
+                if checkpoint:
+                    checkpoint.pending += 1
+                    task.add_done_callback(
+                        lambda task, checkpoint=checkpoint: self._release_after(
+                            task, checkpoint
+                        )
+                    )
+            elif isinstance(command, Follow):
+                select = None
+
+                if i + 1 < len(commands) and isinstance(commands[i + 1], Select):
+                    if self.can_select_while_following(commands[i + 1]):
+                        select = commands[i + 1]
+                        fused = i + 1
+
+                get_contexts = self._follow_contexts(
+                    session, get_contexts or resolved(contexts), select, command
+                )
+            elif isinstance(command, Select):
+                get_contexts = self._select_texts(
+                    get_contexts or resolved(contexts), command
+                )
+            else:
+                raise ValueError
 
-        return get_new_contexts(new_contexts)
+        return get_contexts
+
+    async def _execute_block(self, session, get_contexts, block, position=None):
+        if position is None:
+            return await self._iterate_block(session, await get_contexts, block)
+
+        # Checkpoints are of whole iterations, so the top-level Blocks of lanes are iterated one
+        # level at a time.
+        depth = 0
 
-    async def _execute_block(self, session, get_contexts, block):
         while True:
+            contexts = await get_contexts
+            self._checkpoint(current_checkpoint.get().lane, position, contexts)
+            get_contexts = resolved(contexts)
+
             result = await self._execute_commands(session, get_contexts, block.commands)
+            depth += 1
+
+            if not isinstance(result, list) and self._is_too_deep(depth):
+                result = await result
 
             if isinstance(result, list):
+                self._checkpoint(current_checkpoint.get().lane, position + 1, result)
                 return result
 
             get_contexts = result
 
-    async def _print_texts(self, get_contexts):
-        for context in await get_contexts:
-            self.print(context.text)
+    async def _iterate_block(self, session, contexts, block):
+        """Run the block's commands on each context, and again on each context they return as
+        soon as it is returned, until none are. Return the contexts reached through the most
+        iterations, or the given ones if none were returned.
+
+        Contexts are keyed by their path of indices through the iterations, so that the result
+        comes in the order that iterating level by level would give it in."""
+
+        finished = Queue()
+        tasks = set()
+        deepest = []
+
+        def start(key, context):
+            task = asyncio.create_task(
+                self._iterate_once(session, context, block.commands)
+            )
+            task.add_done_callback(
+                lambda task: finished.put_nowait((key, context, task))
+            )
+            tasks.add(task)
+
+        try:
+            for i, context in enumerate(contexts):
+                start((i,), context)
+
+            while tasks:
+                key, context, task = await finished.get()
+                tasks.discard(task)
+                new_contexts = task.result()
+
+                if new_contexts and not self._is_too_deep(len(key)):
+                    for i, new_context in enumerate(new_contexts):
+                        start(key + (i,), new_context)
+
+                    continue
+
+                if new_contexts:
+                    ends = [(key + (i,), c) for i, c in enumerate(new_contexts)]
+                else:
+                    ends = [(key, context)]
+
+                if not deepest or len(ends[0][0]) > len(deepest[0][0]):
+                    deepest = ends
+                elif len(ends[0][0]) == len(deepest[0][0]):
+                    deepest += ends
+        finally:
+            await cancel_all(tasks)
+
+        if self._ordered:
+            deepest.sort(key=lambda item: item[0])
+
+        return [context for _, context in deepest]
+
+    def _is_too_deep(self, depth):
+        """Tell whether a Block is not to iterate again after depth iterations."""
+        return self._budget.depth is not None and depth >= self._budget.depth
+
+    async def _iterate_once(self, session, context, commands):
+        get_contexts = self._execute_chain(session, [context], commands)
+
+        if get_contexts is None:
+            return []
+
+        return list(filter(None, flatten(await get_contexts)))
+
+    def _commands_at(self, path):
+        commands = self._code
+
+        for i in path:
+            commands = commands[i].commands
+
+        return commands
+
+    def _resume(self, position, contexts, texts):
+        """Run the script in a distributed worker on the contexts of the page followed by the
+        Follow at position, a path of indices through the Blocks, or by none if empty, adding
+        the collected texts to texts."""
+        if not position:
+            self._run_distributed((), contexts, texts)
+            return
+
+        path = position
+
+        while True:
+            contexts, _ = self._run_segment(path[:-1], path[-1] + 1, contexts, texts)
+            path = path[:-1]
+
+            # The contexts reached the end of a Block's commands, so it iterates on them, and
+            # those it ends at go on after it.
+            if not path or not contexts:
+                return
+
+            contexts, _ = self._iterate_distributed(path, contexts, texts)
+
+    def _run_distributed(self, path, contexts, texts):
+        """Run the commands at path on the contexts. Return the contexts they end with, and
+        whether the run goes on in other workers."""
+        commands = self._commands_at(path)
+        start = 0
+
+        while True:
+            if start == len(commands):
+                return [], False
+
+            result = self._run_segment(path, start, contexts, texts)
+            end = next(
+                (
+                    i
+                    for i in range(start, len(commands))
+                    if isinstance(commands[i], Collect)
+                ),
+                len(commands),
+            )
+
+            if end == len(commands):
+                return result
+
+            # Commands after a Collect run on the contexts again.
+            start = end + 1
+
+    def _run_segment(self, path, start, contexts, texts):
+        """Run the commands at path from start up to the next Collect on the contexts. Return the
+        contexts they end with if there is no Collect, and whether the run goes on in other
+        workers."""
+        commands = self._commands_at(path)
+        more = False
+
+        for i in range(start, len(commands)):
+            command = commands[i]
+            started = time.perf_counter()
+
+            if isinstance(command, Collect):
+                texts.extend(context.text for context in contexts)
+                self._record(command, len(contexts), len(contexts), started)
+                return [], more
+            elif isinstance(command, Follow):
+                return [], self._defer(path + (i,), contexts) or more
+            elif isinstance(command, Block):
+                contexts, block_more = self._iterate_distributed(
+                    path + (i,), contexts, texts
+                )
+                more = more or block_more
+            elif isinstance(command, Select):
+                count = len(contexts)
+                contexts = [
+                    Context(context.locator, selectee)
+                    for context in contexts
+                    for selectee in command.select(context.document)
+                ]
+                self._record(command, count, len(contexts), started)
+            else:
+                raise ValueError
+
+        return contexts, more
+
+    def _iterate_distributed(self, path, contexts, texts):
+        """Iterate the Block at path on the contexts. Return the contexts that its iterations end
+        at here, and whether they go on in other workers."""
+        ends = []
+        more = False
+
+        for context in contexts:
+            new_contexts, new_more = self._run_distributed(path, [context], texts)
+            more = more or new_more
+
+            if new_contexts:
+                new_ends, new_more = self._iterate_distributed(
+                    path, new_contexts, texts
+                )
+                ends += new_ends
+                more = more or new_more
+            elif not new_more:
+                ends.append(context)
+
+        return ends, more
+
+    def _defer(self, position, contexts):
+        """Leave following the contexts' locators and going on from position after to the
+        workers of their shards. Return whether any weren't visited yet."""
+        locators = [self.join(context.locator, context.text) for context in contexts]
+        return bool(
+            self._frontier.add(
+                position,
+                [(locator, self._shard(locator, self._shards)) for locator in locators],
+            )
+        )
+
+    def _forget_bg_task(self, task):
+        # Finished tasks are dropped right away so that they don't pile up. Failed ones are kept
+        # for _run_with_session to raise.
+        if task.cancelled() or task.exception() is None:
+            self._bg_tasks.discard(task)
+
+    async def _print_texts(self, get_contexts, position=None, collect=None):
+        contexts = await get_contexts
+        started = time.perf_counter()
+
+        for context in contexts:
+            if self._is_out_of_results():
+                break
+
+            self._collected += 1
+
+            if self._results is None:
+                self.print(context.text)
+            else:
+                await self._results.put(context)
+
+        if self._is_out_of_results():
+            self._out_of_budget.set()
+
+        self._record(collect, len(contexts), len(contexts), started)
+
+        # A top-level Collect finishes its lane.
+        if position is not None:
+            self._release(current_checkpoint.get())
+
+    def _is_out_of_results(self):
+        return (
+            self._budget.results is not None and self._collected >= self._budget.results
+        )
+
+    async def _wait_for_consumer(self):
+        if self._results is None:
+            return
+
+        async with self._results_taken:
+            await self._results_taken.wait_for(lambda: not self._results.full())
 
     @abstractmethod
     def print(self, text):
         raise NotImplementedError
 
-    async def _follow_contexts(self, session, get_contexts):
-        contexts = []
+    def _reset_follows(self, max_follows):
+        if max_follows:
+            self._follow_semaphore = asyncio.Semaphore(max_follows)
+        else:
+            self._follow_semaphore = None
+
+    async def _follow_contexts(self, session, get_contexts, select=None, follow=None):
+        results = await self._follow_all(session, get_contexts, select, follow)
+        # Locators that were skipped leave no context.
+        return list(filter(None, flatten(results)))
+
+    async def _follow_all(self, session, get_contexts, select=None, follow=None):
+        """Return the result of follow(), or of follow_and_select() if select is given, for each
+        context's locator not visited yet. follow is the Follow command, if not following the
+        initial locators."""
+
+        locators = []
 
         for context in await get_contexts:
+            # Once out of pages, the run ends with what the pages followed lead to.
+            if self._budget.pages is not None and self._followed >= self._budget.pages:
+                break
+
             locator = self.join(context.locator, context.text)
 
-            if locator in self._visited_locators:
+            if locator in self._refollowed:
+                self._refollowed.discard(locator)
+            elif not self._visited.add(locator):
                 continue
 
-            self._visited_locators.add(locator)
-            contexts.append(await self.follow(session, locator))
+            locators.append(locator)
+            self._followed += 1
 
-        return contexts
+            if current_checkpoint.get():
+                current_checkpoint.get().visited.add(locator)
+
+        tasks = [
+            asyncio.create_task(self._follow_locator(session, locator, select, follow))
+            for locator in locators
+        ]
+
+        # Once one fails, the others are cancelled, so that none goes on in the shared session.
+        try:
+            if self._ordered:
+                return await asyncio.gather(*tasks)
+
+            return [await task for task in asyncio.as_completed(tasks)]
+        finally:
+            await cancel_all(tasks)
+
+    async def _follow_locator(self, session, locator, select=None, follow=None):
+        await self._wait_for_consumer()
+
+        if not self._follow_semaphore:
+            return await self._follow_or_select(session, locator, select, follow)
+
+        async with self._follow_semaphore:
+            return await self._follow_or_select(session, locator, select, follow)
+
+    async def _follow_or_select(self, session, locator, select, follow):
+        started = time.perf_counter()
+
+        if select is None:
+            result = await self.follow(session, locator)
+            self._record(follow, 1, int(result is not None), started)
+        else:
+            result = await self.follow_and_select(session, locator, select)
+            self._record(follow, 1, len(result or []), started)
+
+        return result
 
     @abstractmethod
     async def follow(self, session, locator):
+        """Return the context of the page at locator, or None to skip it."""
         raise NotImplementedError
 
+    def can_select_while_following(self, select):
+        """Tell whether follow_and_select() is worth calling instead of selecting from what
+        follow() returns."""
+        return False
+
+    async def follow_and_select(self, session, locator, select):
+        """Return the contexts selected from the page at locator, or None to skip it."""
+        context = await self.follow(session, locator)
+
+        if context is None:
+            return None
+
+        return await self._select_texts(resolved([context]), select)
+
     @abstractmethod
     def join(self, base, locator):
         raise NotImplementedError
 
     async def _select_texts(self, get_contexts, selector):
-        contexts = []
+        contexts = await get_contexts
 
-        for context in await get_contexts:
-            for selectee in selector.select(context.text):
-                contexts.append(Context(context.locator, selectee))
+        started = time.perf_counter()
 
-        return contexts
+        if self._executor:
+            selected = await self._select_in_executor(selector, contexts)
+        else:
+            selected = (selector.select(context.document) for context in contexts)
+
+        result = [
+            Context(context.locator, selectee)
+            for context, selectees in zip(contexts, selected)
+            for selectee in selectees
+        ]
+        self._record(selector, len(contexts), len(result), started)
+        return result
+
+    async def _select_in_executor(self, selector, contexts):
+        """Select from the contexts' documents in the executor, e.g. a pool of worker processes,
+        so that parsing and selecting don't hold up the event loop."""
+
+        loop = asyncio.get_running_loop()
+        documents = [context.document for context in contexts]
+        batches = [
+            documents[i : i + self.select_batch_size]
+            for i in range(0, len(documents), self.select_batch_size)
+        ]
+        selections = [
+            loop.run_in_executor(self._executor, select_all, selector, batch)
+            for batch in batches
+        ]
+
+        if not self._ordered:
+            return flatten_once(await asyncio.gather(*selections))
+
+        # Handed back in the order they were asked for, as selecting in-process would, so that
+        # e.g. the contexts of a Block are collected in the order of the document.
+        previous = self._last_selection
+        self._last_selection = done = loop.create_future()
+
+        try:
+            selected = await asyncio.gather(*selections)
+
+            if previous:
+                await previous
+
+            return flatten_once(selected)
+        finally:
+            done.set_result(None)
@@ -0,0 +1,19 @@
+class Budget:
+    """Limits past which a run stops early, with what it collected so far.
+
+    Once pages pages were followed, no more are, and the run ends when what they lead to is done.
+    Once results texts were collected, or seconds seconds have passed, the run is stopped at once,
+    cancelling the requests in flight. Blocks iterate at most depth times from the contexts they
+    start from, and go on after them with the contexts that the last iterations returned.
+    """
+
+    def __init__(self, pages=None, results=None, depth=None, seconds=None):
+        self.pages = pages
+        self.results = results
+        self.depth = depth
+        self.seconds = seconds
+
+    @property
+    def stops(self):
+        """Whether the run may have to be stopped before it ends on its own"""
+        return self.results is not None or self.seconds is not None
@@ -0,0 +1,138 @@
+from dataclasses import dataclass, field
+import hashlib
+import json
+import time
+import os
+
+
+@dataclass
+class Response:
+    url: str
+    encoding: str
+    stored: float
+    headers: dict = field(default_factory=dict)
+    body: bytes = b""
+    # Only responses with status 200 are cached.
+    status: int = 200
+    # Documents selected from the body while it was being read, instead of the body.
+    documents: list = None
+
+    def validators(self):
+        headers = {}
+
+        if "ETag" in self.headers:
+            headers["If-None-Match"] = self.headers["ETag"]
+
+        if "Last-Modified" in self.headers:
+            headers["If-Modified-Since"] = self.headers["Last-Modified"]
+
+        return headers
+
+
+class ResponseCache:
+    """On-disk cache of fetched pages, keyed by URL and request headers.
+
+    Entries younger than ttl seconds are used without contacting the server. Older ones are
+    revalidated with their ETag or Last-Modified, if they have one. Once the bodies take more than
+    max_size bytes, the least recently used entries are removed."""
+
+    kept_headers = ("Content-Type", "ETag", "Last-Modified")
+
+    def __init__(self, directory, ttl=3600.0, max_size=1 << 30):
+        self._directory = directory
+        self._ttl = ttl
+        self._max_size = max_size
+
+        os.makedirs(directory, exist_ok=True)
+        self._size = sum(size for _, _, size in self._bodies())
+
+    def key(self, url, headers):
+        digest = hashlib.sha256(url.encode())
+
+        for name, value in sorted(headers.items()):
+            digest.update(f"\n{name}: {value}".encode())
+
+        return digest.hexdigest()
+
+    def load(self, key):
+        try:
+            with open(self._path(key, ".json")) as file:
+                metadata = json.load(file)
+
+            with open(self._path(key, ".body"), "rb") as file:
+                body = file.read()
+        except (OSError, ValueError):
+            return None
+
+        # Modification time of the body marks its last use.
+        os.utime(self._path(key, ".body"))
+        return Response(body=body, **metadata)
+
+    def is_fresh(self, response):
+        return time.time() - response.stored < self._ttl
+
+    def store(self, key, response):
+        response.headers = {
+            name: response.headers[name]
+            for name in self.kept_headers
+            if name in response.headers
+        }
+        response.stored = time.time()
+
+        try:
+            self._size -= os.path.getsize(self._path(key, ".body"))
+        except OSError:
+            pass
+
+        self._write(key, ".body", response.body)
+        self._write_metadata(key, response)
+        self._size += len(response.body)
+
+        if self._size > self._max_size:
+            self._evict()
+
+    def refresh(self, key, response):
+        response.stored = time.time()
+        self._write_metadata(key, response)
+
+    def _write_metadata(self, key, response):
+        metadata = {
+            "url": response.url,
+            "encoding": response.encoding,
+            "stored": response.stored,
+            "headers": response.headers,
+        }
+        self._write(key, ".json", json.dumps(metadata).encode())
+
+    def _write(self, key, suffix, data):
+        # Written aside first so that an interrupted run never leaves a truncated entry.
+        path = self._path(key, suffix)
+
+        with open(path + ".tmp", "wb") as file:
+            file.write(data)
+
+        os.replace(path + ".tmp", path)
+
+    def _evict(self):
+        # Evict down to 90% of the limit, so that this doesn't run again on the next store.
+        for _, path, size in sorted(self._bodies()):
+            if self._size <= self._max_size * 0.9:
+                break
+
+            for suffix in (".json", ".body"):
+                try:
+                    os.remove(path[: -len(".body")] + suffix)
+                except OSError:
+                    pass
+
+            self._size -= size
+
+    def _bodies(self):
+        with os.scandir(self._directory) as entries:
+            for entry in entries:
+                if entry.name.endswith(".body"):
+                    stat = entry.stat()
+                    yield stat.st_mtime, entry.path, stat.st_size
+
+    def _path(self, key, suffix):
+        return os.path.join(self._directory, key + suffix)
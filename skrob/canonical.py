@@ -0,0 +1,75 @@
+from fnmatch import fnmatchcase
+from yarl import URL
+import re
+
+# A parameter of a path segment, e.g. ;jsessionid=... in Java servlets' URLs.
+path_parameter = re.compile(r";([^/;=?]*)(?:=[^/;?]*)?")
+
+
+class Canonicalizer:
+    """Rewriter of URLs to a canonical form, so that URLs of a page that differ in ways that don't
+    matter to it are followed once.
+
+    Besides what yarl normalizes, e.g. the case of the scheme and host, it leaves out default
+    ports, fragments, and the query and path parameters whose names match one of the
+    case-insensitive glob patterns of drop_parameters. The rest of the query parameters are
+    sorted by name if sort_query, keeping the order of those of the same name. With
+    strip_trailing_slash, the path's trailing slash is left out too, except for the root's.
+    """
+
+    # Session IDs and click trackers, which leave the pages the same.
+    default_drop_parameters = (
+        "sid",
+        "phpsessid",
+        "jsessionid",
+        "sessionid",
+        "session_id",
+        "utm_*",
+        "fbclid",
+        "gclid",
+    )
+
+    def __init__(
+        self,
+        drop_parameters=default_drop_parameters,
+        sort_query=True,
+        strip_trailing_slash=False,
+    ):
+        self._drop_parameters = [pattern.lower() for pattern in drop_parameters]
+        self._sort_query = sort_query
+        self._strip_trailing_slash = strip_trailing_slash
+
+    def __call__(self, url):
+        url = URL(url)
+
+        if not url.absolute:
+            return str(url)
+
+        path = path_parameter.sub(
+            lambda match: "" if self._is_dropped(match.group(1)) else match.group(0),
+            url.raw_path,
+        )
+
+        if self._strip_trailing_slash and path != "/":
+            path = path.rstrip("/") or "/"
+
+        # Split by hand, as yarl would encode a query string again when setting it.
+        query = [
+            parameter
+            for parameter in url.raw_query_string.split("&")
+            if parameter and not self._is_dropped(parameter.split("=", 1)[0])
+        ]
+
+        if self._sort_query:
+            query.sort(key=lambda parameter: parameter.split("=", 1)[0])
+
+        if url.is_default_port():
+            url = url.with_port(None)
+
+        # Setting the path leaves out the query and fragment.
+        canonical = str(url.with_path(path, encoded=True))
+        return canonical + "?" + "&".join(query) if query else canonical
+
+    def _is_dropped(self, name):
+        name = name.lower()
+        return any(fnmatchcase(name, pattern) for pattern in self._drop_parameters)
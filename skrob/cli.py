@@ -1,29 +1,10 @@
-from skrob import Skrob
-from argparse import ArgumentParser
-from http.cookiejar import MozillaCookieJar
-from aiohttp import ClientTimeout, CookieJar
-from contextlib import nullcontext
-import importlib.metadata
-import asyncio
+from skrob.retry import RetryPolicy
+from argparse import Action, ArgumentParser, ArgumentTypeError, SUPPRESS
+from contextlib import nullcontext, suppress
+import os
 import sys
 
 
-class SkrobCookieJar(CookieJar):
-    def save(self, file_path):
-        jar = MozillaCookieJar(file_path)
-        for name, cookie in self._cookies.items():
-            jar.set_cookie(cookie)
-
-        jar.save()
-
-    def load(self, file_path):
-        jar = MozillaCookieJar(file_path)
-        jar.load()
-
-        for cookie in jar:
-            self._cookies[cookie.name] = cookie
-
-
 class Tee:
     def __init__(self, stream1, stream2):
         self._stream1 = stream1
@@ -64,6 +45,68 @@ def run(
 ):
     parser = build_parser()
     args = parser.parse_args(argv[1:])
+    batch = args.batch or args.listen
+    distributed = args.distribute or args.shard
+
+    if batch and args.code is not None:
+        parser.error("the jobs give the scripts and URLs with --batch and --listen")
+    elif not batch and args.code is None:
+        parser.error("the following arguments are required: CODE")
+
+    if args.record and args.replay:
+        parser.error("--record can't be used with --replay")
+    elif args.cache_dir and (args.record or args.replay):
+        parser.error("--cache-dir can't be used with --record or --replay")
+
+    if batch or distributed:
+        modes = "--batch or --listen" if batch else "--distribute or --shard"
+
+        for option, given in [
+            ("--shard", batch and args.shard),
+            ("--state", args.state),
+            ("--visited database", batch and args.visited == "database"),
+            ("--stats", args.stats),
+            ("--record", distributed and args.record),
+            ("--max-pages", distributed and args.max_pages),
+            ("--max-results", distributed and args.max_results),
+            ("--max-depth", distributed and args.max_depth),
+            ("--max-time", distributed and args.max_time),
+            ("--get-urls", args.get_urls),
+            ("--pass-forward", args.pass_forward),
+            ("--explain", batch and args.explain),
+        ]:
+            if given:
+                parser.error(f"{option} can't be used with {modes}")
+
+    if args.explain:
+        from skrob.skrob import explain, optimize, parse
+
+        output_stream.write(explain(optimize(parse(args.code))))
+        return
+
+    # Imported only once the arguments are parsed, as importing them takes long, which e.g.
+    # --help doesn't have to wait for.
+    from skrob import Skrob
+    from skrob.batch import Batch
+    from skrob.budget import Budget
+    from skrob.cache import ResponseCache
+    from skrob.canonical import Canonicalizer
+    from skrob.cookies import SkrobCookieJar
+    from skrob.frontier import Frontier
+    from skrob.output import BufferedWriter
+    from skrob.state import CrawlState
+    from skrob.politeness import Politeness
+    from skrob.stats import Stats
+    from skrob.warc import WarcArchive, WarcWriter
+    from skrob.visited import (
+        VisitedSet,
+        VisitedDigests,
+        VisitedBloomFilter,
+        VisitedDatabase,
+    )
+    from aiohttp import ClientTimeout
+    import asyncio
+    import signal
 
     log_and_url_stream = Tee(log_stream, url_stream)
 
@@ -80,37 +123,290 @@ def run(
             (field, value) = field_value.split(":", maxsplit=1)
             headers[field] = value
 
-    cookie_jar = SkrobCookieJar()
+    resolve = {}
+
+    if args.resolve:
+        for host_address in args.resolve:
+            host, address = host_address.split(":", maxsplit=1)
+            resolve[host] = address
+
+    cache = None
+
+    if args.cache_dir:
+        cache = ResponseCache(
+            args.cache_dir, args.cache_ttl, int(args.cache_size * 1024 * 1024)
+        )
+
+    record = None
+    replay = None
+
+    if args.record:
+        record = WarcWriter(args.record)
+    elif args.replay:
+        replay = WarcArchive(args.replay)
+
+    def new_visited():
+        if args.visited == "digests":
+            return VisitedDigests()
+        elif args.visited == "bloom":
+            return VisitedBloomFilter(args.visited_capacity, args.visited_error_rate)
+        elif args.visited == "database":
+            # Without a state to resume, the database is only needed during the run.
+            path = args.visited_file or (args.state + ".db" if args.state else "")
+            return VisitedDatabase(path)
+
+        return VisitedSet()
+
+    state_files = ()
+
+    if args.state and args.visited == "database" and not args.visited_file:
+        state_files = [args.state + ".db" + suffix for suffix in ("", "-wal", "-shm")]
+
+    stats = None
+
+    if args.stats:
+        stats = Stats()
+
+    executor = None
+
+    if args.workers:
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+        if args.worker_threads:
+            executor = ThreadPoolExecutor(args.workers)
+        else:
+            executor = ProcessPoolExecutor(args.workers)
+
+    canonicalize = None
+
+    if args.canonicalize:
+        canonicalize = Canonicalizer(
+            Canonicalizer.default_drop_parameters + tuple(args.drop_parameters or ()),
+            sort_query=not args.keep_query_order,
+            strip_trailing_slash=args.strip_trailing_slash,
+        )
+
+    budget = Budget(args.max_pages, args.max_results, args.max_depth, args.max_time)
+
+    # Shared by the jobs with --batch and --listen, so that they respect the limits together.
+    politeness = Politeness(
+        rate=args.rate,
+        burst=args.burst,
+        max_concurrency=args.max_connections_per_host,
+        adaptive=args.adaptive,
+    )
+
+    def new_skrob(code, output_stream=None):
+        return Skrob(
+            code,
+            output_stream,
+            log_and_url_stream,
+            max_follows=args.max_follows,
+            ordered=not args.unordered,
+            flush_interval=None if args.line_buffered else args.flush_interval,
+            cache=cache,
+            state=args.state
+            and CrawlState(args.state, args.state_interval, state_files),
+            visited=new_visited(),
+            politeness=politeness,
+            retry=RetryPolicy(
+                args.retries, args.retry_backoff, statuses=args.retry_statuses
+            ),
+            skip_errors=args.skip_errors,
+            log_stream=log_stream,
+            stream=args.stream,
+            executor=executor,
+            stats=stats,
+            canonicalize=canonicalize,
+            dedup_bodies=args.dedup_bodies,
+            record=record,
+            replay=replay,
+            budget=budget,
+        )
+
+    if not batch:
+        skrob = new_skrob(args.code, output_stream)
+
+    if args.shard:
+        frontier = Frontier(args.frontier)
+    elif args.distribute:
+        frontier = Frontier(args.frontier)
+        skrob.seed(
+            frontier,
+            args.url or (sys.stdin.read().split() if not sys.stdin.isatty() else []),
+            args.distribute,
+        )
 
-    if args.cookie_jar:
-        cookie_jar.load(args.cookie_jar)
+    async def crawl():
+        # The jar needs a running loop.
+        cookie_jar = SkrobCookieJar()
 
-    skrob = Skrob(args.code, output_stream, log_and_url_stream)
-    result = asyncio.run(
-        skrob.run(
-            args.url or (sys.stdin.read() if not sys.stdin.isatty() else ""),
+        if args.cookie_jar:
+            cookie_jar.load(args.cookie_jar)
+
+        if stats and hasattr(signal, "SIGUSR1"):
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGUSR1, write_stats, stats, args, log_stream
+            )
+
+        session = Skrob.create_session(
             limit_per_host=args.max_connections_per_host,
             limit=args.max_connections,
+            keepalive_timeout=args.keepalive_timeout or None,
+            force_close=not args.keepalive_timeout,
+            ttl_dns_cache=args.dns_cache_ttl or None,
+            use_dns_cache=bool(args.dns_cache_ttl),
+            resolve=resolve,
             headers=headers,
-            cookie_jar=SkrobCookieJar(),
+            cookie_jar=cookie_jar,
             timeout=ClientTimeout(
                 connect=args.connect_timeout, total=args.total_timeout
             ),
         )
-    )
+        result = None
+
+        async with session:
+            if args.shard:
+                await skrob.work(frontier, *args.shard, session)
+            elif args.distribute:
+                await distribute(skrob, frontier, argv, args.distribute)
+            elif args.listen:
+                if hasattr(signal, "SIGTERM"):
+                    # For the socket to be removed and the cookies saved on termination too.
+                    asyncio.get_running_loop().add_signal_handler(
+                        signal.SIGTERM, asyncio.current_task().cancel
+                    )
+
+                with suppress(asyncio.CancelledError):
+                    await Batch(new_skrob, args.batch_jobs).serve(session, args.listen)
+            elif args.batch:
+                writer = BufferedWriter(
+                    output_stream, None if args.line_buffered else args.flush_interval
+                )
+                await Batch(new_skrob, args.batch_jobs).run(session, sys.stdin, writer)
+            else:
+                result = await skrob.run(
+                    args.url or (sys.stdin.read() if not sys.stdin.isatty() else ""),
+                    session,
+                )
+
+        if args.cookie_jar:
+            cookie_jar.save(args.cookie_jar)
+
+        return result
 
-    if args.cookie_jar:
-        cookie_jar.save(args.cookie_jar)
+    try:
+        result = asyncio.run(crawl())
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+        if record:
+            record.close()
+        elif replay:
+            replay.close()
+
+        if stats:
+            write_stats(stats, args, log_stream)
 
     if result and passforward_stream:
         for context in result:
             passforward_stream.write(context.text + "\n")
 
 
+async def distribute(skrob, frontier, argv, shards):
+    """Start a worker process for each shard of a distributed run, with the same arguments, and
+    print what they collect until they are done."""
+    import asyncio
+
+    workers = [
+        await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "skrob",
+            *argv[1:],
+            "--shard",
+            f"{shard}/{shards}",
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+        )
+        for shard in range(shards)
+    ]
+
+    async def wait_for(shard, worker):
+        if await worker.wait():
+            raise RuntimeError(
+                f"Worker of shard {shard} exited with {worker.returncode}"
+            )
+
+    tasks = [asyncio.create_task(skrob.print_results(frontier))] + [
+        asyncio.create_task(wait_for(shard, worker))
+        for shard, worker in enumerate(workers)
+    ]
+
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+
+        for worker in workers:
+            if worker.returncode is None:
+                worker.kill()
+                await worker.wait()
+
+
+def shard(text):
+    """Parse a shard of workers, e.g. 0/4 for the first of four, into its index and count."""
+    index, _, count = text.partition("/")
+
+    try:
+        index, count = int(index), int(count)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid shard: {text!r}")
+
+    if not 0 <= index < count:
+        raise ArgumentTypeError(f"invalid shard: {text!r}")
+
+    return index, count
+
+
+def write_stats(stats, args, log_stream):
+    text = stats.format(args.stats_format)
+
+    if not args.stats_file:
+        log_stream.write(text)
+        log_stream.flush()
+        return
+
+    # Written aside first, so that whoever reads the file never sees it half-written.
+    with open(args.stats_file + ".tmp", "w") as file:
+        file.write(text)
+
+    os.replace(args.stats_file + ".tmp", args.stats_file)
+
+
+class VersionAction(Action):
+    """Like argparse's version action, but looks the version up only if asked for it, as that
+    takes long"""
+
+    def __init__(self, option_strings, dest=SUPPRESS, default=SUPPRESS, help=None):
+        super().__init__(option_strings, dest, default=default, nargs=0, help=help)
+
+    def __call__(self, parser, namespace, values, option_string=None):
+        import importlib.metadata
+
+        print(importlib.metadata.version(__package__ or __name__))
+        parser.exit()
+
+
 def build_parser():
     parser = ArgumentParser(add_help=False)
 
-    parser.add_argument("code", metavar="CODE")
+    parser.add_argument("code", metavar="CODE", nargs="?")
     parser.add_argument("url", metavar="URL", nargs="*")
 
     parser.add_argument(
@@ -120,8 +416,7 @@ def build_parser():
     )
     parser.add_argument(
         "--version",
-        action="version",
-        version=importlib.metadata.version(__package__ or __name__),
+        action=VersionAction,
         help="Print program version and exit",
     )
 
@@ -141,6 +436,112 @@ def build_parser():
         help="Print the output of the last command instead of the extracted results, and write the latter to fd 4 instead. Mutually exclusive with -u (default: %(default)s)",
     )
 
+    batch_group = parser.add_mutually_exclusive_group()
+    batch_group.add_argument(
+        "--batch",
+        dest="batch",
+        action="store_true",
+        help='Instead of CODE and URLs, run jobs read from stdin as JSON lines like {"id": "a", "code": "...", "urls": ["..."]}, concurrently over shared connections, each with its own visited URLs. Prints JSON lines of each job\'s results {"id": ..., "text": ...}, then {"id": ..., "done": true, "results": N}, or {"id": ..., "error": ...} (default: %(default)s)',
+    )
+    batch_group.add_argument(
+        "--listen",
+        metavar="SOCKET",
+        dest="listen",
+        help="Like --batch, but run the jobs read from each connection to a Unix socket created at SOCKET, and write their output back to it, until interrupted",
+    )
+    batch_group.add_argument(
+        "--distribute",
+        metavar="N",
+        dest="distribute",
+        type=int,
+        help="Run in N worker processes, each following the URLs of the hosts that hash to it and running the script on their pages, while sharing the URLs to follow and the visited ones through --frontier. Prints what they collect, unordered, and every context that a Block's iterations end at goes on after it, not only those reached through the most iterations",
+    )
+    parser.add_argument(
+        "--shard",
+        metavar="I/N",
+        dest="shard",
+        type=shard,
+        help="Work as the I-th, counting from 0, of N workers of a distributed run that shares --frontier, as --distribute starts them",
+    )
+    parser.add_argument(
+        "--frontier",
+        metavar="FILE",
+        dest="frontier",
+        default="skrob-frontier.db",
+        help="SQLite database file the workers of --distribute share the URLs to follow, the visited ones and what they collect through. Emptied at start (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-jobs",
+        metavar="N",
+        dest="batch_jobs",
+        default="8",
+        type=int,
+        help="Maximum number of jobs to run at once with --batch and --listen (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--flush-interval",
+        metavar="SECONDS",
+        dest="flush_interval",
+        default="0.5",
+        type=float,
+        help="Maximum time in seconds printed results and URLs may wait in the output buffer before being flushed. Can be fractional (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--line-buffered",
+        dest="line_buffered",
+        action="store_true",
+        help="Flush the output after every line, overriding --flush-interval (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--explain",
+        dest="explain",
+        action="store_true",
+        help="Print the plan that the script runs as once optimized, with its commands labelled as in --stats, and exit without running it (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stats",
+        dest="stats",
+        action="store_true",
+        help="Report counters and latency histograms of the run, by command of the script, stage of handling pages, host and response status, on exit and on SIGUSR1 (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stats-format",
+        dest="stats_format",
+        default="text",
+        choices=("text", "json", "prometheus"),
+        help="Format of the --stats report: a human-readable table, JSON or the Prometheus text format (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--stats-file",
+        metavar="FILE",
+        dest="stats_file",
+        help="Write the --stats report to FILE, overwriting it each time, instead of stderr",
+    )
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        help="Parse HTML pages while they download, when the command after following them is a CSS select of elements by their name and attributes only, keeping no more of the pages than what is selected. Saves memory on large pages (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "-j",
+        "--workers",
+        metavar="N",
+        dest="workers",
+        default="0",
+        type=int,
+        help="Number of worker processes to parse pages and run selects in, so as to use more than one core. Pass 0 to do it all in the main process (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--worker-threads",
+        dest="worker_threads",
+        action="store_true",
+        help="Use threads instead of processes for --workers. Threads need not copy pages to and from the workers, but lxml only runs in parallel while parsing (default: %(default)s)",
+    )
+
     parser.add_argument(
         "-H",
         "--add-header",
@@ -156,6 +557,118 @@ def build_parser():
         help="Netscape-formatted (aka cookies.txt) file to read cookies from and overwrite afterwards",
     )
 
+    parser.add_argument(
+        "--cache-dir",
+        metavar="DIR",
+        dest="cache_dir",
+        help="Directory to keep fetched pages in, to be reused by later runs instead of being downloaded again",
+    )
+    parser.add_argument(
+        "--cache-ttl",
+        metavar="SECONDS",
+        dest="cache_ttl",
+        default="3600.0",
+        type=float,
+        help="Time in seconds for which a cached page is reused without asking the server. Older pages are revalidated with their ETag or Last-Modified header (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--cache-size",
+        metavar="MEGABYTES",
+        dest="cache_size",
+        default="1024.0",
+        type=float,
+        help="Size of the cache above which least recently used pages are evicted (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--record",
+        metavar="FILE",
+        dest="record",
+        help="Record the requests and responses of the run to FILE in the WARC format, gzipped if FILE ends with .gz, overwriting it. An index to replay it with is written to FILE.idx",
+    )
+    parser.add_argument(
+        "--replay",
+        metavar="FILE",
+        dest="replay",
+        help="Take the pages from the WARC file FILE, e.g. one recorded with --record, instead of fetching them. Pages that it lacks fail",
+    )
+
+    parser.add_argument(
+        "--state",
+        metavar="FILE",
+        dest="state",
+        help="File to periodically save the progress of the run to. If the run is interrupted, running the same script with the same file resumes it. The file is removed once the run completes",
+    )
+    parser.add_argument(
+        "--state-interval",
+        metavar="SECONDS",
+        dest="state_interval",
+        default="60.0",
+        type=float,
+        help="Minimum time in seconds between saves of the progress to the --state file (default: %(default)s)",
+    )
+
+    parser.add_argument(
+        "--visited",
+        dest="visited",
+        default="set",
+        choices=["set", "digests", "bloom", "database"],
+        help="How to remember visited URLs: set keeps them whole, digests keeps 8-byte hashes of them, bloom keeps a Bloom filter of fixed size with possible false positives, database keeps hashes in an SQLite file (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--visited-capacity",
+        metavar="N",
+        dest="visited_capacity",
+        default="10000000",
+        type=int,
+        help="Number of URLs the Bloom filter is sized for (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--visited-error-rate",
+        metavar="P",
+        dest="visited_error_rate",
+        default="0.0001",
+        type=float,
+        help="Probability with which the Bloom filter mistakes a new URL for a visited one, once filled to capacity (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--visited-file",
+        metavar="FILE",
+        dest="visited_file",
+        help="SQLite file of the database store. Defaults to the --state file name with .db appended, or else to a temporary file removed after the run",
+    )
+    parser.add_argument(
+        "--canonicalize",
+        dest="canonicalize",
+        action="store_true",
+        help="Rewrite URLs to a canonical form before checking whether they were visited: leave out fragments, default ports, session ID and click tracker parameters (sid, phpsessid, jsessionid, sessionid, session_id, utm_*, fbclid, gclid), and sort query parameters by name (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--drop-parameter",
+        metavar="NAME",
+        dest="drop_parameters",
+        action="append",
+        help="Also leave out the query and path parameters whose names match NAME, a case-insensitive glob pattern, with --canonicalize. This option can be used multiple times",
+    )
+    parser.add_argument(
+        "--keep-query-order",
+        dest="keep_query_order",
+        action="store_true",
+        help="Don't sort query parameters with --canonicalize (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--strip-trailing-slash",
+        dest="strip_trailing_slash",
+        action="store_true",
+        help="Also leave out trailing slashes of paths other than the root with --canonicalize (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dedup-bodies",
+        dest="dedup_bodies",
+        action="store_true",
+        help="Skip pages whose bodies are the same as those of pages followed before, e.g. reached through other URLs (default: %(default)s)",
+    )
+
     parser.add_argument(
         "-n",
         "--max-connections-per-host",
@@ -174,6 +687,124 @@ def build_parser():
         type=int,
         help="Maximum number of simultaneous connections (default: %(default)s)",
     )
+    parser.add_argument(
+        "-w",
+        "--max-follows",
+        metavar="N",
+        dest="max_follows",
+        default=None,
+        type=int,
+        help="Maximum number of pages being fetched at the same time. Defaults to the value of -N, pass 0 to disable",
+    )
+    parser.add_argument(
+        "--unordered",
+        dest="unordered",
+        action="store_true",
+        help="Pass fetched pages on in the order they arrive instead of the order their links appear in (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--max-pages",
+        metavar="N",
+        dest="max_pages",
+        type=int,
+        help="Follow no more than N pages, then finish with what they lead to",
+    )
+    parser.add_argument(
+        "--max-results",
+        metavar="N",
+        dest="max_results",
+        type=int,
+        help="Stop once N results are printed, cancelling the requests in flight",
+    )
+    parser.add_argument(
+        "--max-depth",
+        metavar="N",
+        dest="max_depth",
+        type=int,
+        help="Iterate Blocks no more than N times from each context they start from, e.g. to follow no more than N pages of pagination",
+    )
+    parser.add_argument(
+        "--max-time",
+        metavar="SECONDS",
+        dest="max_time",
+        type=float,
+        help="Stop after SECONDS seconds, cancelling the requests in flight, with the results printed so far",
+    )
+    parser.add_argument(
+        "--rate",
+        metavar="N",
+        dest="rate",
+        default="0.0",
+        type=float,
+        help="Maximum number of requests per second to the same host. Can be fractional, pass 0 to disable (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--burst",
+        metavar="N",
+        dest="burst",
+        default="1",
+        type=int,
+        help="Number of requests to the same host that may be sent at once above --rate after a pause (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--adaptive",
+        dest="adaptive",
+        action="store_true",
+        help="Adjust the number of simultaneous requests to each host between 1 and the value of -n: raise it while the host responds quickly, halve it when the host slows down, fails or asks to back off (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--retries",
+        metavar="N",
+        dest="retries",
+        default=str(RetryPolicy.default_retries),
+        type=int,
+        help="Maximum number of times to retry a request that failed or got one of the --retry-statuses (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--retry-backoff",
+        metavar="SECONDS",
+        dest="retry_backoff",
+        default="1.0",
+        type=float,
+        help="Base of the exponential backoff: the n-th retry waits a random time of up to this times 2^n seconds, or longer if the server asks so with Retry-After. Can be fractional (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--retry-statuses",
+        metavar="CODES",
+        dest="retry_statuses",
+        default=",".join(map(str, sorted(RetryPolicy.default_statuses))),
+        type=lambda codes: {int(code) for code in codes.split(",") if code},
+        help="Comma-separated HTTP status codes of responses to retry, and with --skip-errors, to skip when out of retries (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--skip-errors",
+        dest="skip_errors",
+        action="store_true",
+        help="Report pages that failed after all retries to stderr and carry on without them, instead of stopping (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--keepalive-timeout",
+        metavar="SECONDS",
+        dest="keepalive_timeout",
+        default="30.0",
+        type=float,
+        help="Time in seconds to keep idle connections open for further requests. Can be fractional, pass 0 to close each connection after its request (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dns-cache-ttl",
+        metavar="SECONDS",
+        dest="dns_cache_ttl",
+        default="300",
+        type=int,
+        help="Time in seconds to reuse the results of DNS lookups for, pass 0 to look hosts up for each connection (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--resolve",
+        metavar="HOST:ADDRESS",
+        dest="resolve",
+        action="append",
+        help="Connect to ADDRESS, an IPv4 or IPv6 address, instead of looking HOST up. This option can be used multiple times",
+    )
     parser.add_argument(
         "-t",
         "--connect-timeout",
@@ -0,0 +1,77 @@
+from http.cookiejar import Cookie, MozillaCookieJar, http2time
+from http.cookies import Morsel
+from email.utils import formatdate
+from aiohttp import CookieJar
+from yarl import URL
+import time
+
+
+class SkrobCookieJar(CookieJar):
+    def save(self, file_path):
+        jar = MozillaCookieJar(file_path)
+
+        host_only = {(domain, name) for domain, _, name in self._host_only_cookies}
+
+        for morsel in self:
+            key = (morsel["domain"], morsel.key)
+            jar.set_cookie(to_cookie(morsel, key in host_only))
+
+        jar.save(ignore_discard=True)
+
+    def load(self, file_path):
+        jar = MozillaCookieJar(file_path)
+        jar.load(ignore_discard=True)
+
+        for cookie in jar:
+            domain = cookie.domain.lstrip(".")
+            self.update_cookies(
+                {cookie.name: to_morsel(cookie)}, URL(f"http://{domain}/")
+            )
+
+
+def to_cookie(morsel, host_only):
+    # The jar stores domains without their leading dot, and whether they match subdomains aside.
+    domain = morsel["domain"] if host_only else "." + morsel["domain"]
+    expires = None
+
+    if morsel["max-age"]:
+        expires = int(time.time()) + int(morsel["max-age"])
+    elif morsel["expires"]:
+        expires = http2time(morsel["expires"])
+
+    return Cookie(
+        version=0,
+        name=morsel.key,
+        value=morsel.value,
+        port=None,
+        port_specified=False,
+        domain=domain,
+        domain_specified=domain.startswith("."),
+        domain_initial_dot=domain.startswith("."),
+        path=morsel["path"] or "/",
+        path_specified=True,
+        secure=bool(morsel["secure"]),
+        expires=expires,
+        discard=expires is None,
+        comment=None,
+        comment_url=None,
+        rest={},
+    )
+
+
+def to_morsel(cookie):
+    morsel = Morsel()
+    morsel.set(cookie.name, cookie.value, cookie.value)
+    morsel["path"] = cookie.path
+
+    # Without a Domain attribute, the cookie is sent to its host only.
+    if cookie.domain_initial_dot:
+        morsel["domain"] = cookie.domain
+
+    if cookie.secure:
+        morsel["secure"] = True
+
+    if cookie.expires:
+        morsel["expires"] = formatdate(cookie.expires, usegmt=True)
+
+    return morsel
@@ -0,0 +1,160 @@
+from contextlib import contextmanager
+from .visited import digest
+import json
+
+
+class Frontier:
+    """SQLite database file that the workers of a distributed run share: the locators left to
+    follow, each with the shard of workers it is for and the position in the script to go on
+    from, the locators followed already, and the texts collected, for the coordinator to print.
+
+    It stands in for a network service, so it suits workers on one machine, or on several that
+    share the file over a file system that SQLite's locking works on.
+    """
+
+    def __init__(self, path, timeout=60.0, size=16):
+        # Imported here, as most runs don't use it.
+        import sqlite3
+
+        self._path = path
+        self._size = size
+        # Transactions are begun explicitly, to take the write lock up front.
+        self._connection = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+
+        with self._transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS visited (digest BLOB PRIMARY KEY) WITHOUT ROWID"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS tasks (id INTEGER PRIMARY KEY, shard INTEGER, "
+                "position TEXT, locator TEXT, taken INTEGER DEFAULT 0)"
+            )
+            connection.execute(
+                "CREATE INDEX IF NOT EXISTS tasks_by_shard ON tasks (shard, taken)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS results (id INTEGER PRIMARY KEY, text TEXT)"
+            )
+
+    def reset(self, script_id, shards):
+        """Empty the frontier for a new run of the script by shards shards of workers."""
+        with self._transaction() as connection:
+            for table in ("meta", "visited", "tasks", "results"):
+                connection.execute(f"DELETE FROM {table}")
+
+            connection.executemany(
+                "INSERT INTO meta VALUES (?, ?)",
+                [("script", script_id), ("shards", str(shards)), ("finished", "0")],
+            )
+
+    def check(self, script_id, shards):
+        meta = dict(self._connection.execute("SELECT key, value FROM meta"))
+
+        if meta.get("script") != script_id:
+            raise ValueError(f"Frontier {self._path} is of a different script")
+
+        if meta.get("shards") != str(shards):
+            raise ValueError(
+                f"Frontier {self._path} is for {meta.get('shards')} shards, not {shards}"
+            )
+
+    def add(self, position, locators):
+        """Add the pairs of locators and their shards to follow and go on from position after,
+        unless they were added before. Return the number of those that weren't."""
+        added = 0
+
+        with self._transaction() as connection:
+            for locator, shard in locators:
+                cursor = connection.execute(
+                    "INSERT OR IGNORE INTO visited VALUES (?)",
+                    (digest(locator, self._size),),
+                )
+
+                if cursor.rowcount == 1:
+                    connection.execute(
+                        "INSERT INTO tasks (shard, position, locator) VALUES (?, ?, ?)",
+                        (shard, json.dumps(position), locator),
+                    )
+                    added += 1
+
+        return added
+
+    def take(self, shard, limit):
+        """Mark up to limit of the shard's tasks as taken, and return their ids, positions and
+        locators."""
+        with self._transaction() as connection:
+            tasks = connection.execute(
+                "SELECT id, position, locator FROM tasks WHERE shard = ? AND NOT taken "
+                "ORDER BY id LIMIT ?",
+                (shard, limit),
+            ).fetchall()
+            connection.executemany(
+                "UPDATE tasks SET taken = 1 WHERE id = ?", [(id,) for id, _, _ in tasks]
+            )
+
+        return [
+            (id, tuple(json.loads(position)), locator)
+            for id, position, locator in tasks
+        ]
+
+    def release(self, shard):
+        """Return the shard's taken tasks to the frontier, e.g. those of a worker that stopped
+        before finishing them."""
+        with self._transaction() as connection:
+            connection.execute("UPDATE tasks SET taken = 0 WHERE shard = ?", (shard,))
+
+    def done(self, id, texts):
+        """Remove the finished task, adding the texts it collected."""
+        with self._transaction() as connection:
+            connection.executemany(
+                "INSERT INTO results (text) VALUES (?)", [(text,) for text in texts]
+            )
+            connection.execute("DELETE FROM tasks WHERE id = ?", (id,))
+
+    def pop_results(self):
+        """Remove and return the texts collected so far, in the order they were added."""
+        with self._transaction() as connection:
+            results = connection.execute(
+                "SELECT id, text FROM results ORDER BY id"
+            ).fetchall()
+
+            if results:
+                connection.execute(
+                    "DELETE FROM results WHERE id <= ?", (results[-1][0],)
+                )
+
+        return [text for _, text in results]
+
+    def is_empty(self):
+        return (
+            self._connection.execute("SELECT 1 FROM tasks LIMIT 1").fetchone() is None
+        )
+
+    def finish(self):
+        """Tell the workers that the run is over."""
+        self._connection.execute("UPDATE meta SET value = '1' WHERE key = 'finished'")
+
+    def is_finished(self):
+        return self._connection.execute(
+            "SELECT value = '1' FROM meta WHERE key = 'finished'"
+        ).fetchone() == (1,)
+
+    def close(self):
+        self._connection.close()
+
+    @contextmanager
+    def _transaction(self):
+        self._connection.execute("BEGIN IMMEDIATE")
+
+        try:
+            yield self._connection
+        except BaseException:
+            self._connection.execute("ROLLBACK")
+            raise
+
+        self._connection.execute("COMMIT")
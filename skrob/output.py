@@ -0,0 +1,57 @@
+import traceback
+import asyncio
+import sys
+
+
+class BufferedWriter:
+    """Stream writer that flushes at most every flush_interval seconds, or as soon as flush_size
+    characters are pending. Without flush_interval, it flushes after every write."""
+
+    def __init__(self, stream, flush_interval=None, flush_size=65536):
+        self._stream = stream
+        self._flush_interval = flush_interval
+        self._flush_size = flush_size
+        self._pending = 0
+        self._timer = None
+        self._broken = False
+
+    def write(self, text):
+        if self._broken:
+            return
+
+        try:
+            self._stream.write(text)
+        except BrokenPipeError:
+            self._exit_on_broken_pipe()
+
+        self._pending += len(text)
+
+        if self._flush_interval is None or self._pending >= self._flush_size:
+            self.flush()
+        elif self._timer is None:
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self.flush()
+            else:
+                self._timer = loop.call_later(self._flush_interval, self.flush)
+
+    def flush(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+        self._pending = 0
+
+        if self._broken:
+            return
+
+        try:
+            self._stream.flush()
+        except BrokenPipeError:
+            self._exit_on_broken_pipe()
+
+    def _exit_on_broken_pipe(self):
+        self._broken = True
+        traceback.print_exc()
+        sys.exit(1)
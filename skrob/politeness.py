@@ -0,0 +1,209 @@
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from yarl import URL
+import asyncio
+import math
+import time
+
+# Statuses with which servers ask to be left alone for a while.
+throttling_statuses = {429, 503}
+
+
+def parse_retry_after(value):
+    """Return the delay in seconds that a Retry-After header value asks for, or None if invalid"""
+
+    if value is None:
+        return None
+
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class Request:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.status = None
+        self.retry_after = None
+
+    def record(self, status, headers):
+        self.status = status
+
+        if status in throttling_statuses:
+            self.retry_after = parse_retry_after(headers.get("Retry-After"))
+
+
+class Host:
+    """Throttle of the requests to a single host.
+
+    Requests are paced by a token bucket of burst tokens refilled at rate per second, and no more
+    than limit of them are in flight at once. If adaptive, limit grows by one per round trip
+    while the host responds quickly, and is halved when it fails, throttles or slows down, i.e.
+    when its average latency exceeds latency_factor times the lowest seen.
+    """
+
+    def __init__(
+        self,
+        rate=None,
+        burst=1,
+        min_concurrency=1,
+        max_concurrency=None,
+        adaptive=False,
+        latency_factor=2.0,
+        max_retry_after=300.0,
+    ):
+        self._rate = rate
+        self._burst = burst
+        self._min_concurrency = min_concurrency
+        self._max_concurrency = max_concurrency or math.inf
+        self._adaptive = adaptive
+        self._latency_factor = latency_factor
+        self._max_retry_after = max_retry_after
+
+        self.limit = min_concurrency if adaptive else self._max_concurrency
+        self._active = 0
+        self._waiters = []
+        self._tokens = burst
+        self._refilled = time.monotonic()
+        self._blocked_until = 0.0
+        self._pacing = asyncio.Lock()
+        self._latency = None
+        self._min_latency = None
+        self._decreased = 0.0
+
+    async def acquire(self):
+        while self._active >= self.limit:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+
+            try:
+                await waiter
+            finally:
+                self._waiters.remove(waiter)
+
+        self._active += 1
+
+        try:
+            await self._pace()
+        except BaseException:
+            self.release()
+            raise
+
+    def release(self):
+        self._active -= 1
+        self._wake()
+
+    def _wake(self):
+        # The woken check again whether there is room for them.
+        for waiter in self._waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    async def _pace(self):
+        # Held while sleeping, so that the requests leave in the order they got here.
+        async with self._pacing:
+            while True:
+                now = time.monotonic()
+                delay = self._blocked_until - now
+
+                if self._rate:
+                    self._tokens = min(
+                        self._burst, self._tokens + (now - self._refilled) * self._rate
+                    )
+                    self._refilled = now
+                    delay = max(delay, (1 - self._tokens) / self._rate)
+
+                if delay <= 0:
+                    break
+
+                await asyncio.sleep(delay)
+
+            if self._rate:
+                self._tokens -= 1
+
+    def completed(self, request):
+        now = time.monotonic()
+        latency = now - request.started
+
+        if request.retry_after is not None:
+            self._blocked_until = max(
+                self._blocked_until,
+                now + min(request.retry_after, self._max_retry_after),
+            )
+
+        if request.status is None or request.status in throttling_statuses:
+            self._decrease(now)
+            return
+
+        if self._latency is None:
+            self._latency = latency
+        else:
+            self._latency += 0.2 * (latency - self._latency)
+
+        self._min_latency = min(self._min_latency or latency, latency)
+
+        if self._latency > self._latency_factor * self._min_latency:
+            self._decrease(now)
+        elif request.status < 500:
+            self._increase()
+        else:
+            self._decrease(now)
+
+    def _increase(self):
+        if self._adaptive:
+            self.limit = min(self._max_concurrency, self.limit + 1 / self.limit)
+            self._wake()
+
+    def _decrease(self, now):
+        # At most once per round trip, as the requests in flight meanwhile were sent at the same
+        # limit and would likely fail too.
+        if not self._adaptive or now - self._decreased < (self._latency or 0):
+            return
+
+        self.limit = max(self._min_concurrency, self.limit / 2)
+        self._decreased = now
+
+
+class Politeness:
+    """Per-host scheduler of requests. Takes the arguments of Host, applied to each host."""
+
+    def __init__(self, **kwargs):
+        self._kwargs = kwargs
+        self._hosts = {}
+
+    @asynccontextmanager
+    async def request(self, url):
+        """Wait for the turn of a request to the url's host. Inside, the request's response
+        status and headers are to be passed to record() of the yielded Request. A request left
+        without a status, e.g. by an exception, counts as failed."""
+
+        host_name = URL(url).host
+
+        if host_name not in self._hosts:
+            self._hosts[host_name] = Host(**self._kwargs)
+
+        host = self._hosts[host_name]
+        await host.acquire()
+        request = Request()
+        cancelled = False
+
+        try:
+            yield request
+        except asyncio.CancelledError:
+            cancelled = True
+            raise
+        except Exception:
+            # E.g. a timeout while reading the body, after the status was recorded.
+            request.status = None
+            raise
+        finally:
+            host.release()
+
+            if not cancelled:
+                host.completed(request)
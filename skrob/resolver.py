@@ -0,0 +1,41 @@
+from aiohttp.abc import AbstractResolver
+from aiohttp.resolver import DefaultResolver
+import ipaddress
+import socket
+
+
+class StaticResolver(AbstractResolver):
+    """DNS resolver that resolves the hosts in a map of host names to IP addresses without a
+    lookup, and other hosts with the default resolver."""
+
+    def __init__(self, addresses):
+        self._addresses = {
+            host.lower(): ipaddress.ip_address(address)
+            for host, address in addresses.items()
+        }
+        self._resolver = None
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        address = self._addresses.get(host.lower())
+
+        if address is None:
+            # Created on first use, as it needs a running loop.
+            if self._resolver is None:
+                self._resolver = DefaultResolver()
+
+            return await self._resolver.resolve(host, port, family)
+
+        return [
+            {
+                "hostname": host,
+                "host": str(address),
+                "port": port,
+                "family": socket.AF_INET6 if address.version == 6 else socket.AF_INET,
+                "proto": 0,
+                "flags": socket.AI_NUMERICHOST,
+            }
+        ]
+
+    async def close(self):
+        if self._resolver is not None:
+            await self._resolver.close()
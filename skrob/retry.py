@@ -0,0 +1,34 @@
+import random
+
+
+class RetryPolicy:
+    """When and after how long to retry a request.
+
+    A request is retried up to retries times if it raises one of skrob.skrob.retryable_errors, but
+    not of skrob.skrob.permanent_errors, or gets a response with one of statuses. The n-th retry
+    waits a random time of up to backoff * 2^n seconds, or as long as the response's Retry-After
+    asks if that is longer, but no more than max_delay seconds.
+    """
+
+    default_retries = 2
+    default_statuses = frozenset({408, 429, 500, 502, 503, 504})
+
+    def __init__(
+        self,
+        retries=default_retries,
+        backoff=1.0,
+        max_delay=300.0,
+        statuses=default_statuses,
+    ):
+        self.retries = retries
+        self.statuses = frozenset(statuses)
+        self._backoff = backoff
+        self._max_delay = max_delay
+
+    def delay(self, attempt, retry_after=None):
+        delay = random.uniform(0, self._backoff * 2**attempt)
+
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+
+        return min(delay, self._max_delay)
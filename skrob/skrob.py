@@ -1,193 +1,1435 @@
 from .bcfs import Context, Block, Collect, Follow, Select, Bcfs
+from .output import BufferedWriter
+from .cache import Response
+from .politeness import parse_retry_after
+from .resolver import StaticResolver
+from .stats import stage
 
 from dataclasses import dataclass
+from contextlib import asynccontextmanager
 from parsel import Selector
-from aiohttp import ClientSession, TCPConnector
+from parsel.csstranslator import GenericTranslator, HTMLTranslator
+from cssselect.parser import Attrib, Class, CombinedSelector, Element, Hash
+from cssselect.parser import FunctionalPseudoElement, SelectorError
+from aiohttp import (
+    ClientConnectionError,
+    ClientPayloadError,
+    ClientSession,
+    ClientSSLError,
+    ClientTimeout,
+    ServerFingerprintMismatch,
+    TCPConnector,
+)
 from json import JSONDecodeError
 from lxml import etree
 from yarl import URL
 
-from parsimonious.grammar import Grammar
-from parsimonious.nodes import NodeVisitor
-
+from copy import deepcopy
 import importlib.metadata
-import traceback
-import dicttoxml
-import parsel
+import functools
+import itertools
+import hashlib
+import cssselect
+import codecs
+import jmespath
 import json
+import asyncio
+import time
 import sys
 import re
 
-grammar = Grammar(
-    r"""
-    script = commands{1}
-    commands = ws_commands ws
-    ws_commands = ws_command*
-    ws_command = ws command
-    command = block / collect / follow / select
-    block = ws '{' commands '}' ws
-    collect = ';'
-    follow = '->'
-    select = xpath_select / css_select
-    xpath_select = '%' xpath '%'
-    xpath = (escaped_percent / ~'[^%]')*
-    escaped_percent = '\\%'
-    css_select = (!terminal ~'.')+
-    terminal = '->' / ~'[{};%]'
-    ws = ~'\s*'
+html_translator = HTMLTranslator()
+xml_translator = GenericTranslator()
+
+
+# Errors of a single request, which another attempt may not run into: connections that failed or
+# broke off, and timeouts.
+retryable_errors = (ClientConnectionError, ClientPayloadError, asyncio.TimeoutError)
+# Those of them that every attempt runs into, as the server's certificate doesn't change.
+permanent_errors = (ClientSSLError, ServerFingerprintMismatch)
+
+
+class Parser:
+    """Parser of scripts, whose grammar is:
+
+        commands = (ws command)* ws
+        command = block / collect / follow / select
+        block = '{' commands '}'
+        collect = ';'
+        follow = '->'
+        select = xpath_select / jmespath_select / css_select
+        xpath_select = '%' ('\\%' / [^%])* '%'
+        jmespath_select = '&' ('\\&' / [^&])* '&'
+        css_select = (bracketed / quoted / !terminal [^\\n])+
+        bracketed = '[' (quoted / !inner_terminal [^\\]'"\\n])* ']'
+        quoted = "'" (!inner_terminal [^'\\n])* "'" / '"' (!inner_terminal [^"\\n])* '"'
+        terminal = inner_terminal / '&'
+        inner_terminal = '->' / [{};%]
+        ws = \\s*
+
+    Escaped ampersands are unescaped in JMESPath, but escaped percent signs are kept in XPath.
+    Ampersands in attribute selectors and strings, e.g. in URLs, are part of the CSS.
     """
+
+    whitespace = re.compile(r"\s*")
+    css_quoted = r"'(?:(?!->)[^'{};%\n])*'|\"(?:(?!->)[^\"{};%\n])*\""
+    css_select = re.compile(
+        rf"(?:\[(?:{css_quoted}|(?!->)[^\]'\"{{}};%\n])*\]|{css_quoted}|(?!->)[^{{}};%&\n])+"
+    )
+
+    def __init__(self, code):
+        self._code = code
+        self._position = 0
+
+    def parse(self):
+        commands = self._commands()
+
+        if self._position < len(self._code):
+            raise self._error("Unmatched '}'", self._position)
+
+        return commands
+
+    def _commands(self):
+        commands = []
+
+        while True:
+            self._position = self.whitespace.match(self._code, self._position).end()
+            command = self._command()
+
+            if command is None:
+                return commands
+
+            commands.append(command)
+
+    def _command(self):
+        code = self._code
+        start = self._position
+
+        if start == len(code) or code[start] == "}":
+            return None
+
+        if code[start] == "{":
+            self._position += 1
+            commands = self._commands()
+
+            if self._position == len(code):
+                raise self._error("Unmatched '{'", start)
+
+            self._position += 1
+            return Block(commands)
+
+        if code[start] == ";":
+            self._position += 1
+            return Collect()
+
+        if code.startswith("->", start):
+            self._position += 2
+            return Follow()
+
+        if code[start] == "%":
+            return XpathSelect(self._delimited("%"))
+
+        if code[start] == "&":
+            return JmespathSelect(self._delimited("&").replace("\\&", "&"))
+
+        match = self.css_select.match(code, start)
+        self._position = match.end()
+        return CssSelect(match.group())
+
+    def _delimited(self, delimiter):
+        code = self._code
+        start = self._position
+        position = start + 1
+
+        while position < len(code) and code[position] != delimiter:
+            position += 2 if code.startswith("\\" + delimiter, position) else 1
+
+        if position >= len(code):
+            raise self._error(f"Unmatched {delimiter!r}", start)
+
+        self._position = position + 1
+        return code[start + 1 : position]
+
+    def _error(self, message, position):
+        line = self._code.count("\n", 0, position) + 1
+        column = position - self._code.rfind("\n", 0, position)
+        return ValueError(f"{message} at line {line}, column {column} of the script")
+
+
+# The same scripts are often parsed many times in a process, and compiling their selects takes
+# longer than parsing them. The parsed scripts are shared, so are not to be modified.
+@functools.lru_cache(maxsize=256)
+def parse(code):
+    return Parser(code).parse()
+
+
+def is_json(content_type, text):
+    """Tell whether a page with the given Content-Type and text is to be parsed as JSON"""
+
+    mimetype = (content_type or "").split(";")[0].strip().lower()
+
+    if mimetype in ("application/json", "text/json") or mimetype.endswith("+json"):
+        return True
+
+    # Servers often label JSON as something else. It can be told from HTML at its first
+    # character, whereas trying to parse every page takes as long as the page is.
+    return text.lstrip()[:1] in ("{", "[")
+
+
+# Charsets declared in a Content-Type header, and in a meta element, which is looked for in the
+# first 1024 bytes of a page, as browsers do.
+header_charset = re.compile(r"""charset\s*=\s*["']?([^"';\s]+)""", re.I)
+meta_charset = re.compile(
+    rb"""<meta[^>]+charset\s*=\s*["']?\s*([a-z0-9_:.+-]+)""", re.I
 )
 
 
-class Visitor(NodeVisitor):
-    def visit_script(self, node, visited_children):
-        return visited_children[0]
+# Byte order marks, which browsers trust over any declared charset. utf-16 and utf-8-sig leave
+# them out of the decoded text.
+byte_order_marks = (
+    (codecs.BOM_UTF8, "utf-8-sig"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+)
 
-    def visit_commands(self, node, visited_children):
-        return visited_children[0]
 
-    def visit_ws_commands(self, node, visited_children):
-        return visited_children
+def sniff_encoding(content_type, body):
+    """Return the encoding of a page's body: that of its byte order mark, else the charset that
+    its Content-Type declares, else that of a meta element at its start, else UTF-8.
 
-    def visit_ws_command(self, node, visited_children):
-        return visited_children[1]
+    Unlike aiohttp's get_encoding(), it doesn't guess from the bytes, as that takes long on large
+    pages and, of those that declare no charset, most are UTF-8 anyway."""
 
-    def visit_command(self, node, visited_children):
-        return visited_children[0]
+    for mark, encoding in byte_order_marks:
+        if body.startswith(mark):
+            return encoding
 
-    def visit_block(self, node, visited_children):
-        return Block(visited_children[2])
+    match = header_charset.search(content_type or "")
 
-    def visit_collect(self, node, visited_children):
-        return Collect()
+    if match:
+        encoding = lookup_encoding(match.group(1))
 
-    def visit_follow(self, node, visited_children):
-        return Follow()
+        if encoding:
+            return encoding
 
-    def visit_select(self, node, visited_children):
-        return visited_children[0]
+    match = meta_charset.search(body[:1024])
 
-    def visit_xpath_select(self, node, visited_children):
-        return visited_children[1]
+    if match:
+        encoding = lookup_encoding(match.group(1).decode("ascii"))
 
-    def visit_xpath(self, node, visited_children):
-        return XpathSelect(node.text)
+        # A meta element readable as ASCII isn't in UTF-16 or UTF-32, as browsers reason too.
+        if encoding and not encoding.startswith(("utf-16", "utf-32")):
+            return encoding
 
-    def visit_escaped_percent(self, node, visited_children):
-        return "%"
+    return "utf-8"
 
-    def visit_css_select(self, node, visited_children):
-        return CssSelect(node.text)
 
-    def generic_visit(self, node, visited_children):
+def lookup_encoding(name):
+    try:
+        return codecs.lookup(name).name
+    except LookupError:
         return None
 
 
-def parse(code):
-    tree = grammar.parse(code)
+# Errors of lxml's parser on bytes that aren't valid UTF-8.
+decoding_errors = {
+    etree.ErrorTypes.ERR_INVALID_CHAR,
+    etree.ErrorTypes.ERR_INVALID_ENCODING,
+}
 
-    visitor = Visitor()
-    return visitor.visit(tree)
 
+def parse_html(body, encoding):
+    """Parse an HTML page from its bytes in the encoding, handing them to lxml as they are if
+    they are in UTF-8.
 
-@dataclass
-class XpathSelect(Select):
-    def select(self, text):
-        def string_join(context, nodeset, sep=""):
-            return sep.join(
-                map(lambda n: n if isinstance(n, str) else n.text_content(), nodeset)
-            )
+    Bodies in other encodings are converted to UTF-8 first, as Python's codecs do that faster than
+    lxml decodes them. Bodies that aren't valid UTF-8, and ones with null bytes, which parsel
+    strips from text, are decoded to text first, replacing undecodable bytes."""
+
+    if encoding != "utf-8":
+        with stage("decode"):
+            body = body.decode(encoding, "replace").encode()
+
+    if b"\0" not in body:
+        parser = etree.HTMLParser(recover=True, encoding="utf-8", huge_tree=True)
+
+        try:
+            root = etree.fromstring(body, parser=parser)
+        except etree.XMLSyntaxError:
+            root = None
+
+        if root is not None and not any(
+            error.type in decoding_errors for error in parser.error_log
+        ):
+            return Selector(root=root, type="html")
+
+    return Selector(body.decode("utf-8", "replace"))
+
+
+class Document:
+    """Page or its part that is parsed and serialized lazily, at most once each.
+
+    A page is kept as its body's bytes and their encoding, which lxml parses without them being
+    decoded to text first. They are decoded only if the whole page's text is needed.
+
+    A part of a page is kept as its element, and selected from as the page that reparsing its text
+    would give, as it was when parts were kept as text: the element is put in html, and body or
+    head, elements, and selects run on the html element. CSS selects that can't tell the
+    difference run on the element itself."""
+
+    def __init__(
+        self,
+        text=None,
+        selector=None,
+        body=None,
+        encoding="utf-8",
+        node=None,
+        type="html",
+    ):
+        self._text = text
+        self._selector = selector
+        self._body = body
+        self._encoding = encoding
+        self._node = node
+        self._type = type
+
+    @classmethod
+    def wrap(cls, document):
+        if isinstance(document, Document):
+            return document
+
+        return cls(document)
+
+    @classmethod
+    def from_node(cls, node, type):
+        if isinstance(node, etree._Element):
+            return cls(node=node, type=type)
+
+        # Strings, numbers and booleans are treated as text to parse, as before.
+        if node is True:
+            return cls("1")
+        elif node is False:
+            return cls("0")
+
+        return cls(str(node))
+
+    @property
+    def node(self):
+        """The element of a part of a page, or None"""
+        return self._node
+
+    @property
+    def type(self):
+        if self._node is not None:
+            return self._type
+
+        return self.selector.type
+
+    @property
+    def selector(self):
+        if self._selector is None:
+            with stage("parse"):
+                if self._node is not None:
+                    self._selector = Selector(root=as_page(self._node), type=self._type)
+                elif self._text is None and self._body is not None:
+                    self._selector = parse_html(self._body, self._encoding)
+                else:
+                    self._selector = Selector(self._text)
+
+        return self._selector
+
+    def __str__(self):
+        if self._text is None:
+            if self._node is not None:
+                self._text = Selector(root=self._node, type=self._type).get()
+            elif self._body is not None:
+                with stage("decode"):
+                    self._text = self._body.decode(self._encoding, "replace")
+            else:
+                self._text = self._selector.get()
+
+        return self._text
+
+    def __reduce__(self):
+        # Pickled as text, e.g. to be sent to worker processes, as lxml trees can't be pickled.
+        # Parts of pages are selected from as their reparsed text here too, so the same is
+        # selected on either side.
+        if self._text is None and self._body is not None:
+            return (Document, (None, None, self._body, self._encoding))
+
+        return (Document, (str(self),))
+
+
+class JsonDocument(Document):
+    """JSON page or its part, parsed and serialized lazily.
+
+    JMESPath selects work on the JSON itself. CSS and XPath selects see it converted to XML, and
+    so does the text of a whole page, for the scripts written before JSON was handled natively.
+    """
+
+    def __init__(self, json_text=None, value=None, page=False):
+        super().__init__()
+        self._json_text = json_text
+        self._value = value
+        self._page = page
+
+    @classmethod
+    def from_value(cls, value):
+        # Strings are treated as text to parse, as are strings selected with XPath.
+        if isinstance(value, str):
+            return Document(value)
+
+        return cls(value=value)
+
+    @property
+    def page(self):
+        """Whether it is a whole page, rather than a value selected from one"""
+        return self._page
+
+    @property
+    def value(self):
+        if self._value is None and self._json_text is not None:
+            with stage("json"):
+                self._value = json.loads(self._json_text)
+
+        return self._value
+
+    @property
+    def json_text(self):
+        if self._json_text is None:
+            self._json_text = json.dumps(self._value, ensure_ascii=False)
+
+        return self._json_text
+
+    @property
+    def selector(self):
+        if self._selector is None:
+            xml = self._to_xml()
 
-        def split(context, nodeset, length):
-            chunks = []
+            with stage("parse"):
+                self._selector = Selector(xml)
 
-            for i in range(0, len(nodeset), int(length)):
-                chunk_node = etree.Element("chunk")
+        return self._selector
 
-                for node in nodeset[i : i + int(length)]:
-                    chunk_node.append(node)
+    def _to_xml(self):
+        # Imported here, as it is only needed for CSS and XPath on JSON.
+        import dicttoxml
 
-                chunks.append(chunk_node)
+        value = self.value
 
-            return chunks
+        with stage("xml"):
+            return dicttoxml.dicttoxml(value, return_bytes=False)
 
-        parsel.xpathfuncs.set_xpathfunc("string-join", string_join)
-        parsel.xpathfuncs.set_xpathfunc("split", split)
+    def __reduce__(self):
+        return (JsonDocument, (self.json_text, None, self._page))
 
-        result = Selector(text).xpath(self.query).getall()
+    def __str__(self):
+        if self._text is None:
+            self._text = self._to_xml() if self._page else self.json_text
 
-        parsel.xpathfuncs.set_xpathfunc("string-join", None)
-        parsel.xpathfuncs.set_xpathfunc("split", None)
+        return self._text
+
+
+# Elements that reparsing a part of a page puts in the head, not the body.
+head_tags = {"base", "link", "meta", "script", "style", "title"}
+
+
+def as_page(node):
+    """Return the html element of a copy of the element, put in the elements that reparsing its
+    text as a page puts it in."""
+    node = deepcopy(node)
+    node.tail = None
+
+    if node.tag == "html":
+        return node
+
+    root = etree.Element("html")
+
+    if node.tag in ("head", "body"):
+        root.append(node)
+    else:
+        etree.SubElement(root, "head" if node.tag in head_tags else "body").append(node)
+
+    return root
+
+
+def string_join(context, nodeset, sep=""):
+    return sep.join(
+        map(lambda n: n if isinstance(n, str) else "".join(n.itertext()), nodeset)
+    )
+
+
+def split(context, nodeset, length):
+    chunks = []
+
+    for i in range(0, len(nodeset), int(length)):
+        chunk_node = etree.Element("chunk")
+
+        # Copy, as the nodes may still be part of a document that is selected from again.
+        for node in nodeset[i : i + int(length)]:
+            chunk_node.append(deepcopy(node))
+
+        chunks.append(chunk_node)
+
+    return chunks
+
+
+class CompiledXpath:
+    namespaces = {
+        "re": "http://exslt.org/regular-expressions",
+        "set": "http://exslt.org/sets",
+    }
+    # Passed to each expression instead of being registered in the global function namespace.
+    extensions = {(None, "string-join"): string_join, (None, "split"): split}
+
+    def __init__(self, xpath, in_place=False):
+        self.xpath = xpath
+        # Whether it selects the same from a part of a page as from the page that reparsing the
+        # part gives, so that it can be evaluated on the part's element itself.
+        self.in_place = in_place
+        self._evaluate = etree.XPath(
+            xpath,
+            namespaces=self.namespaces,
+            extensions=self.extensions,
+            smart_strings=False,
+        )
+
+    def select(self, document):
+        nodes, type = self.evaluate_on(document)
+        return [Document.from_node(node, type) for node in nodes]
+
+    def evaluate_on(self, document):
+        """Return what evaluating on the document selects, and the type of the document."""
+        if self.in_place and document.node is not None:
+            return self.evaluate(document.node), document.type
+
+        selector = document.selector
+
+        if not isinstance(selector.root, etree._Element):
+            raise ValueError(
+                f"Cannot use XPath on a document of type {selector.type!r}"
+            )
+
+        return self.evaluate(selector.root), selector.type
+
+    def select_nodes(self, nodes):
+        """Return what evaluating on each of the elements of parts of pages selects, as select()
+        on documents of them would, but without making those."""
+        if not self.in_place:
+            nodes = map(as_page, nodes)
+
+        return [selected for node in nodes for selected in self.evaluate(node)]
+
+    def evaluate(self, node):
+        result = self._evaluate(node)
+
+        if not isinstance(result, list):
+            return [result]
 
         return result
 
 
+@dataclass
+class XpathSelect(Select):
+    def __post_init__(self):
+        self._compiled = CompiledXpath(self.query)
+
+    def compiled(self, type):
+        return self._compiled
+
+    def select(self, document):
+        return self._compiled.select(Document.wrap(document))
+
+
 @dataclass
 class CssSelect(Select):
-    def select(self, text):
+    def __post_init__(self):
         query = re.sub(r"(^|(?<=[^\\]))!", ":not(*)", self.query)
-        return Selector(text).css(query).getall()
+
+        in_place = selects_inside(query)
+        self._html_compiled = CompiledXpath(
+            html_translator.css_to_xpath(query), in_place
+        )
+        self._xml_compiled = CompiledXpath(xml_translator.css_to_xpath(query), in_place)
+        self._stream_test = StreamTest.compile(query)
+
+    @property
+    def streamable(self):
+        return self._stream_test is not None
+
+    def select_streamed(self, encoding):
+        """Return a StreamedSelection of this select, which must be streamable"""
+        return StreamedSelection(self._stream_test, self._html_compiled, encoding)
+
+    def compiled(self, type):
+        """Return the CompiledXpath that the select runs as on documents of the type."""
+        return self._xml_compiled if type == "xml" else self._html_compiled
+
+    def select(self, document):
+        document = Document.wrap(document)
+        return self.compiled(document.type).select(document)
+
+
+# Whitespace as in XPath's normalize-space(), which class selects are translated to.
+xpath_whitespace = re.compile(r"[ \t\r\n]+")
+
+
+def includes_word(attribute, value):
+    if not value or xpath_whitespace.search(value):
+        return False
+
+    return value in xpath_whitespace.split(attribute or "")
+
+
+def equals_or_prefixes(attribute, value):
+    return attribute is not None and (
+        attribute == value or attribute.startswith(value + "-")
+    )
+
+
+# Operators of CSS attribute selects. As in their XPath translations, ^=, $= and *= never match
+# an empty value.
+attribute_tests = {
+    "exists": lambda attribute, value: attribute is not None,
+    "=": lambda attribute, value: attribute == value,
+    "!=": lambda attribute, value: attribute != value,
+    "~=": includes_word,
+    "|=": equals_or_prefixes,
+    "^=": lambda attribute, value: bool(value) and (attribute or "").startswith(value),
+    "$=": lambda attribute, value: bool(value) and (attribute or "").endswith(value),
+    "*=": lambda attribute, value: bool(value) and value in (attribute or ""),
+}
+
+
+def selects_inside(query):
+    """Tell whether a CSS select selects only from inside the elements that it matches first,
+    none of which can be an html, head or body element without attributes, so that it selects the
+    same from a part of a page as from the page that reparsing the part gives."""
+
+    try:
+        selectors = cssselect.parse(query)
+    except SelectorError:
+        return False
+
+    for selector in selectors:
+        pseudo_element = selector.pseudo_element
+
+        if isinstance(pseudo_element, FunctionalPseudoElement):
+            if pseudo_element.name != "attr":
+                return False
+        elif pseudo_element not in (None, "text"):
+            return False
+
+        tree = selector.parsed_tree
+
+        # Descendants and children stay inside, unlike siblings.
+        while isinstance(tree, CombinedSelector):
+            if (
+                tree.combinator not in (" ", ">")
+                or compound_tests(tree.subselector) is None
+            ):
+                return False
+
+            tree = tree.selector
+
+        tests = compound_tests(tree)
+
+        if tests is None or may_match_wrapper(*tests):
+            return False
+
+    return True
+
+
+def compound_tests(tree):
+    """Return the element name, and the class, ID and attribute selects, of a compound select of
+    nothing else, or None"""
+    tests = []
+
+    while not isinstance(tree, Element):
+        if not isinstance(tree, (Attrib, Class, Hash)):
+            return None
+
+        tests.append(tree)
+        tree = tree.selector
+
+    return tree.element, tests
+
+
+def may_match_wrapper(element, tests):
+    """Tell whether a compound select may match an html, head or body element without
+    attributes"""
+    if (element or "*").lower() not in ("*", "html", "head", "body"):
+        return False
+
+    return all(isinstance(test, Attrib) and test.operator == "!=" for test in tests)
+
+
+class StreamTest:
+    """Test of whether an element matches a simple CSS select, i.e. one that looks at nothing but
+    the element's name and attributes, so that it can be done at the element's start tag. Also
+    selects from the matched elements.
+
+    Both are done in Python, as evaluating an XPath expression on each element of a page takes
+    longer than parsing the page.
+    """
+
+    def __init__(self, tag, classes, attributes, pseudo_element=None):
+        self.tag = tag
+        self._classes = classes
+        self._attributes = attributes
+        self._pseudo_element = pseudo_element
+
+    @classmethod
+    def compile(cls, query):
+        """Return the test of the select, or None if the select is not simple"""
+
+        try:
+            selectors = cssselect.parse(query)
+        except SelectorError:
+            return None
+
+        if len(selectors) != 1:
+            return None
+
+        pseudo_element = selectors[0].pseudo_element
+
+        if isinstance(pseudo_element, FunctionalPseudoElement):
+            if pseudo_element.name != "attr" or len(pseudo_element.arguments) != 1:
+                return None
+
+            pseudo_element = ("attr", pseudo_element.arguments[0].value)
+        elif pseudo_element not in (None, "text"):
+            return None
+
+        classes = []
+        attributes = []
+        tree = selectors[0].parsed_tree
+
+        while not isinstance(tree, Element):
+            if isinstance(tree, Class):
+                classes.append(tree.class_name)
+            elif isinstance(tree, Hash):
+                attributes.append(("id", "=", tree.id))
+            elif (
+                isinstance(tree, Attrib)
+                and tree.namespace is None
+                and not getattr(tree, "flag", None)
+                and tree.operator in attribute_tests
+            ):
+                value = tree.value and tree.value.value
+                attributes.append((tree.attrib.lower(), tree.operator, value))
+            else:
+                return None
+
+            tree = tree.selector
+
+        if tree.namespace is not None:
+            return None
+
+        tag = None if tree.element in (None, "*") else tree.element.lower()
+        return cls(tag, classes, attributes, pseudo_element)
+
+    def __call__(self, element):
+        if self.tag is not None and element.tag != self.tag:
+            return False
+
+        if self._classes:
+            classes = xpath_whitespace.split(element.get("class") or "")
+
+            if not all(name in classes for name in self._classes):
+                return False
+
+        return all(
+            attribute_tests[operator](element.get(name), value)
+            for (name, operator, value) in self._attributes
+        )
+
+    def select(self, matches):
+        """Select from the matched elements, given in document order, the outermost first and
+        the others nested in it. Return None if the result would not be in document order.
+        """
+
+        if self._pseudo_element is None:
+            return matches
+
+        if self._pseudo_element == "text":
+            # Text nodes of nested elements interleave.
+            if len(matches) > 1:
+                return None
+
+            texts = [matches[0].text] + [child.tail for child in matches[0]]
+            return [text for text in texts if text is not None]
+
+        _, name = self._pseudo_element
+        values = [element.get(name) for element in matches]
+        return [value for value in values if value is not None]
+
+
+class StreamedSelection:
+    """Selection of a simple CSS select from an HTML page as it is being parsed.
+
+    Elements are tested at their start tags. The outermost matched ones are selected from at
+    their end tags, together with any matches nested in them. Everything outside of them is
+    removed once parsed, so that the tree of the page never takes much more memory than the
+    selected part.
+    """
+
+    def __init__(self, test, compiled, encoding):
+        self._test = test
+        self._compiled = compiled
+        # With a tag to look for, the parser reports no other elements, saving the time of
+        # handling them. They are then removed only once a match ends.
+        self._parser = etree.HTMLPullParser(
+            events=("start", "end"),
+            tag=test.tag,
+            # lxml skips a byte order mark by itself, and doesn't know utf-8-sig.
+            encoding="utf-8" if encoding == "utf-8-sig" else encoding,
+            huge_tree=True,
+        )
+        # The outermost matched element being parsed, and those matched inside of it.
+        self._matches = []
+        self._selected = []
+
+    def feed(self, data):
+        self._parser.feed(data)
+        self._read_events()
+
+    def close(self):
+        try:
+            self._parser.close()
+        except etree.XMLSyntaxError:
+            # Nothing to parse.
+            pass
+
+        self._read_events()
+        return [Document.from_node(node, "html") for node in self._selected]
+
+    def _read_events(self):
+        for event, element in self._parser.read_events():
+            if event == "start":
+                if self._test(element):
+                    self._matches.append(element)
+
+                continue
+
+            if not self._matches:
+                self._remove(element)
+            elif element is self._matches[0]:
+                selected = self._test.select(self._matches)
+
+                if selected is None:
+                    selected = self._compiled.evaluate(element)
+
+                self._selected.extend(self._detach(node) for node in selected)
+                self._matches = []
+                self._remove(element)
+
+    def _remove(self, element):
+        element.clear()
+        ancestors = element.iterancestors() if self._test.tag else ()
+
+        for node in itertools.chain([element], ancestors):
+            while node.getprevious() is not None:
+                del node.getparent()[0]
+
+    def _detach(self, node):
+        if not isinstance(node, etree._Element):
+            return node
+
+        node = deepcopy(node)
+        node.tail = None
+        return node
+
+
+@dataclass
+class JmespathSelect(Select):
+    def __post_init__(self):
+        self._compiled = jmespath.compile(self.query)
+
+    def select(self, document):
+        document = Document.wrap(document)
+
+        if isinstance(document, JsonDocument):
+            value = document.value
+        else:
+            try:
+                value = json.loads(str(document))
+            except JSONDecodeError:
+                raise ValueError("Cannot use JMESPath on a document that is not JSON")
+
+        result = self._compiled.search(value)
+
+        # Like XPath node-sets, lists are split into their items. Nulls are dropped.
+        if not isinstance(result, list):
+            result = [result]
+
+        return [JsonDocument.from_value(item) for item in result if item is not None]
+
+
+@dataclass
+class FusedSelect(Select):
+    """Chain of CSS and XPath selects run as one, each on the elements that the one before it
+    selected as it would on documents of them, but without making those and contexts of them in
+    between.
+
+    Once a select in the chain selects text, attributes or other values, the rest run on them as
+    documents, which reparse them, as they would if not fused. query is the chain's source.
+    """
+
+    selects: list = None
+
+    def __getstate__(self):
+        return {"query": self.query, "selects": self.selects}
+
+    @property
+    def streamable(self):
+        first = self.selects[0]
+        return isinstance(first, CssSelect) and first.streamable
+
+    def select_streamed(self, encoding):
+        """Return a StreamedSelection of the chain, whose first select must be streamable"""
+        selection = self.selects[0].select_streamed(encoding)
+        return FusedStreamedSelection(selection, self.selects[1:])
+
+    def select(self, document):
+        document = Document.wrap(document)
+        nodes, type = self.selects[0].compiled(document.type).evaluate_on(document)
+
+        for i, select in enumerate(self.selects[1:], 1):
+            if not all(isinstance(node, etree._Element) for node in nodes):
+                documents = [Document.from_node(node, type) for node in nodes]
+                return select_each(self.selects[i:], documents)
+
+            nodes = select.compiled(type).select_nodes(nodes)
+
+        return [Document.from_node(node, type) for node in nodes]
+
+
+class FusedStreamedSelection:
+    """StreamedSelection of the first select of a FusedSelect, whose other selects run on what it
+    selects once done"""
+
+    def __init__(self, selection, selects):
+        self._selection = selection
+        self._selects = selects
+
+    def feed(self, data):
+        self._selection.feed(data)
+
+    def close(self):
+        return select_each(self._selects, self._selection.close())
+
+
+def select_each(selects, documents):
+    """Run the selects one after another on the documents."""
+    for select in selects:
+        documents = [
+            selected for document in documents for selected in select.select(document)
+        ]
+
+    return documents
+
+
+def optimize(commands):
+    """Return the commands with each run of consecutive CSS and XPath selects fused into one
+    FusedSelect, leaving out selects of the context node itself, such as %.%, that another select
+    follows, as they select nothing new for it.
+
+    The commands are left as they are, as parsed scripts are shared."""
+
+    optimized = []
+    chain = []
+
+    def end_chain():
+        selects = [
+            select
+            for i, select in enumerate(chain)
+            if i == len(chain) - 1 or not is_identity(select)
+        ]
+
+        if len(selects) > 1:
+            query = "\n".join(map(to_source, selects))
+            optimized.append(FusedSelect(query, selects))
+        else:
+            optimized.extend(selects)
+
+        chain.clear()
+
+    for command in commands:
+        if isinstance(command, (CssSelect, XpathSelect)):
+            chain.append(command)
+            continue
+
+        end_chain()
+
+        if isinstance(command, Block):
+            optimized.append(Block(optimize(command.commands)))
+        else:
+            optimized.append(command)
+
+    end_chain()
+    return optimized
+
+
+def is_identity(select):
+    return isinstance(select, XpathSelect) and select.query.strip() in (
+        ".",
+        "self::node()",
+    )
+
+
+def to_source(select):
+    if isinstance(select, XpathSelect):
+        return f"%{select.query}%"
+    elif isinstance(select, JmespathSelect):
+        return "&" + select.query.replace("&", "\\&") + "&"
+
+    return select.query
+
+
+def explain(commands):
+    """Return the plan that the commands run as, a line for each labelled with its position as in
+    the stats, with the XPath that each CSS select runs as on HTML."""
+    return "".join(line + "\n" for line in plan_lines(commands))
+
+
+def plan_lines(commands, prefix="", indent=""):
+    for i, command in enumerate(commands):
+        path = f"{prefix}{i}"
+
+        if isinstance(command, Block):
+            yield f"{indent}{path} {{}}"
+            yield from plan_lines(command.commands, path + ".", indent + "    ")
+        elif isinstance(command, Collect):
+            yield f"{indent}{path} ;"
+        elif isinstance(command, Follow):
+            yield f"{indent}{path} ->"
+        elif isinstance(command, FusedSelect):
+            yield f"{indent}{path} fused select:"
+
+            for select in command.selects:
+                yield f"{indent}    {describe_select(select)}"
+        else:
+            yield f"{indent}{path} {describe_select(command)}"
+
+
+def describe_select(select):
+    if isinstance(select, CssSelect):
+        return f"css {select.query.strip()} = {select.compiled('html').xpath}"
+    elif isinstance(select, XpathSelect):
+        return f"xpath {select.query.strip()}"
+
+    return f"jmespath {select.query.strip()}"
 
 
 class Skrob(Bcfs):
-    def __init__(self, code, output_stream=sys.stdout, url_stream=sys.stderr):
+    def __init__(
+        self,
+        code,
+        output_stream=sys.stdout,
+        url_stream=sys.stderr,
+        max_follows=None,
+        ordered=True,
+        flush_interval=None,
+        cache=None,
+        state=None,
+        visited=None,
+        politeness=None,
+        retry=None,
+        skip_errors=False,
+        log_stream=sys.stderr,
+        stream=False,
+        executor=None,
+        stats=None,
+        canonicalize=None,
+        dedup_bodies=False,
+        record=None,
+        replay=None,
+        budget=None,
+    ):
+        """canonicalize, e.g. a Canonicalizer, rewrites the URLs to follow before they are checked
+        against the visited ones. With dedup_bodies, pages with the same body as a page followed
+        before in the run are skipped, as if they failed.
+
+        record, a WarcWriter, records the pages fetched. replay, a WarcArchive, is where pages are
+        taken from instead of being fetched. budget, a Budget, limits how far run() goes.
+        """
         if isinstance(code, str):
             code = parse(code)
 
-        super().__init__(code)
+        code = optimize(code)
+        super().__init__(
+            code, max_follows, ordered, state, visited, executor, stats, budget
+        )
+
+        self._cache = cache
+        self._politeness = politeness
+        self._retry = retry
+        self._skip_errors = skip_errors
+        self._log_stream = log_stream
+        self._stream = stream
+        self._canonicalize = canonicalize
+        self._dedup_bodies = dedup_bodies
+        self._body_digests = set()
+        self._recorder = record
+        self._replay = replay
+        self._output_writer = None
+        self._url_writer = None
+
+        if output_stream:
+            self._output_writer = BufferedWriter(output_stream, flush_interval)
 
-        self._output_stream = output_stream
-        self._url_stream = url_stream
+        if url_stream:
+            self._url_writer = BufferedWriter(url_stream, flush_interval)
+
+    # Defaults for TCPConnector that suit crawling, i.e. many requests to a few hosts.
+    connector_defaults = {"keepalive_timeout": 30.0, "ttl_dns_cache": 300}
+
+    @classmethod
+    def create_session(
+        cls, cookie_jar=None, headers=None, timeout=300.0, resolve=None, **kwargs
+    ):
+        """Create a ClientSession for run(), which can share it with other runs.
+
+        The other keyword arguments are passed to TCPConnector. resolve maps host names to the IP
+        addresses to connect to instead of looking them up."""
+
+        headers = dict(headers or {})
+        kwargs = {**cls.connector_defaults, **kwargs}
+
+        if kwargs.get("force_close"):
+            kwargs.pop("keepalive_timeout")
+
+        if resolve:
+            kwargs["resolver"] = StaticResolver(resolve)
+
+        if not isinstance(timeout, ClientTimeout):
+            timeout = ClientTimeout(total=timeout)
 
-    async def run(self, args, cookie_jar=None, headers=None, timeout=300.0, **kwargs):
         if "User-Agent" not in headers:
             headers["User-Agent"] = f"Skrob {importlib.metadata.version('skrob')}"
 
-        async with ClientSession(
-            connector=TCPConnector(**kwargs), headers=headers, timeout=timeout
-        ) as session:
-            # Convenience special handling in case we get input from stdin.
-            if isinstance(args, list):
+        return ClientSession(
+            connector=TCPConnector(**kwargs),
+            cookie_jar=cookie_jar,
+            headers=headers,
+            timeout=timeout,
+        )
+
+    async def run(self, args, session=None, **kwargs):
+        """Run on the URLs in the list args, or on the document in the string args.
+
+        Without a session, runs in one of its own, created by create_session() with the other
+        keyword arguments."""
 
-                async def get_contexts():
-                    return list(map(lambda url: Context(url, url), args))
+        if session is None:
+            async with self.create_session(**kwargs) as session:
+                return await self.run(args, session)
 
-                self._visited_locators = set()
-                initial = await self._follow_contexts(session, get_contexts())
+        self._body_digests = set()
+
+        try:
+            if self._max_follows is None:
+                self._reset_follows(session.connector.limit)
+            else:
+                self._reset_follows(self._max_follows)
+
+            # Convenience special handling in case we get input from stdin.
+            if isinstance(args, list):
+                initial = list(map(lambda url: Context(url, url), args))
+                return await self._run_with_session(session, initial, True)
             elif isinstance(args, str):
-                initial = [Context("", args)]
+                return await self._run_with_session(session, [Context("", args)])
             else:
                 raise ValueError
+        finally:
+            self.flush()
 
-            return await self._run_with_session(session, initial)
+    async def work(self, frontier, shard, shards, session=None, **kwargs):
+        """Work as the shard-th of shards shards of workers of a distributed run, as started by
+        seed(), until it is over.
+
+        Without a session, works in one of its own, created by create_session() with the other
+        keyword arguments."""
+
+        if session is None:
+            async with self.create_session(**kwargs) as session:
+                return await self.work(frontier, shard, shards, session)
+
+        max_tasks = self._max_follows or session.connector.limit or 100
 
-    def print(self, text):
         try:
-            if self._output_stream:
-                self._output_stream.write(text + "\n")
-                self._output_stream.flush()
-        except BrokenPipeError:
-            traceback.print_exc()
-            sys.exit(1)
+            await self._work_with_session(session, frontier, shard, shards, max_tasks)
+        finally:
+            self.flush()
+
+    def shard_key(self, locator):
+        # Pages of a host are fetched by one worker, which keeps to its limits of the host.
+        return URL(locator).host or ""
+
+    def print(self, text):
+        if self._output_writer:
+            self._output_writer.write(text + "\n")
+
+    def flush(self):
+        if self._output_writer:
+            self._output_writer.flush()
+
+        if self._url_writer:
+            self._url_writer.flush()
 
     async def follow(self, session, url):
+        return await self._follow(session, url)
+
+    def can_select_while_following(self, select):
+        # Cached, recorded and replayed pages are read whole anyway.
+        return (
+            self._stream
+            and not self._cache
+            and not self._recorder
+            and not self._replay
+            and isinstance(select, (CssSelect, FusedSelect))
+            and select.streamable
+        )
+
+    async def follow_and_select(self, session, url, select):
+        return await self._follow(session, url, select)
+
+    async def _follow(self, session, url, select=None):
+        if self._url_writer:
+            self._url_writer.write(url + "\n")
+
         try:
-            if self._url_stream:
-                self._url_stream.write(url + "\n")
-                self._url_stream.flush()
-        except BrokenPipeError:
-            traceback.print_exc()
-            sys.exit(1)
+            response = await self._fetch_with_retries(session, url, select)
+
+            if self._skip_errors and self._is_failure(response.status):
+                self._log(f"Skipping {url}: HTTP status {response.status}")
+                return None
+
+            if self._dedup_bodies and response.body is not None:
+                body_digest = hashlib.blake2b(response.body, digest_size=16).digest()
+
+                if body_digest in self._body_digests:
+                    return None
 
-        async with session.get(url) as response:
-            text = await response.text()
+                self._body_digests.add(body_digest)
 
+            if response.documents is not None:
+                return [Context(url, document) for document in response.documents]
+
+            text = None
+            start = response.body[:1024].decode(response.encoding, "replace")
+
+            # Other pages are parsed from their bytes, and decoded only if printed whole.
+            if is_json(response.headers.get("Content-Type"), start):
+                with stage("decode"):
+                    text = response.body.decode(response.encoding, "replace")
+        except Exception as error:
+            if not self._skip_errors:
+                raise
+
+            self._log(f"Skipping {url}: {error!r}")
+            return None
+
+        context = None
+
+        if text is not None:
             try:
-                text = dicttoxml.dicttoxml(json.loads(text), return_bytes=False)
+                with stage("json"):
+                    value = json.loads(text)
+
+                context = Context(url, JsonDocument(text, value, True))
             except JSONDecodeError:
                 pass
 
-            return Context(url, text)
+        if context is None:
+            context = Context(
+                url, Document(body=response.body, encoding=response.encoding)
+            )
+
+        if select is None:
+            return context
+
+        return [Context(url, document) for document in select.select(context.document)]
+
+    def _is_failure(self, status):
+        return self._retry is not None and status in self._retry.statuses
+
+    async def _fetch_with_retries(self, session, url, select=None):
+        if self._replay:
+            # Another attempt would replay the same response.
+            with stage("read"):
+                return self._replay.load(url)
+
+        attempt = 0
+
+        while True:
+            try:
+                response = await self._fetch(session, url, select)
+            except retryable_errors as error:
+                if (
+                    isinstance(error, permanent_errors)
+                    or not self._retry
+                    or attempt >= self._retry.retries
+                ):
+                    raise
+
+                retry_after = None
+                reason = repr(error)
+            else:
+                # Out of retries, a failed response is passed on as any other.
+                if not self._is_failure(response.status) or (
+                    attempt >= self._retry.retries
+                ):
+                    return response
+
+                retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                reason = f"HTTP status {response.status}"
+
+            delay = self._retry.delay(attempt, retry_after)
+            attempt += 1
+            self._log(
+                f"Retrying {url} in {delay:.1f}s ({attempt}/{self._retry.retries}): {reason}"
+            )
+            await asyncio.sleep(delay)
+
+    def _log(self, message):
+        if self._log_stream:
+            self._log_stream.write(message + "\n")
+            self._log_stream.flush()
+
+    async def _fetch(self, session, url, select=None):
+        if not self._cache:
+            async with self._get(session, url) as response:
+                result = await self._read(url, response, select)
+
+                if self._recorder:
+                    self._recorder.record(response, result.body)
+
+                return result
+
+        key = self._cache.key(url, session.headers)
+        cached = self._cache.load(key)
+
+        if cached and self._cache.is_fresh(cached):
+            return cached
+
+        async with self._get(
+            session, url, cached.validators() if cached else None
+        ) as response:
+            if cached and response.status == 304:
+                self._cache.refresh(key, cached)
+                return cached
+
+            result = await self._read(url, response)
+
+            if response.status == 200:
+                self._cache.store(key, result)
+
+            return result
+
+    @asynccontextmanager
+    async def _get(self, session, url, headers=None):
+        if not self._politeness:
+            async with self._measured_get(session, url, headers) as response:
+                yield response
+
+            return
+
+        async with self._politeness.request(url) as request:
+            async with self._measured_get(session, url, headers) as response:
+                request.record(response.status, response.headers)
+                yield response
+
+    @asynccontextmanager
+    async def _measured_get(self, session, url, headers=None):
+        if not self._stats:
+            async with session.get(url, headers=headers) as response:
+                yield response
+
+            return
+
+        started = time.perf_counter()
+        status = None
+        wait = None
+        size = 0
+
+        try:
+            async with session.get(url, headers=headers) as response:
+                wait = time.perf_counter() - started
+                status = response.status
+                yield response
+                size = response.content.total_bytes
+        except BaseException:
+            # Failed while reading the body, after the status came.
+            status = None
+            raise
+        finally:
+            self._stats.request(
+                URL(url).host, status, wait, time.perf_counter() - started, size
+            )
+
+    async def _read(self, url, response, select=None):
+        if select is not None:
+            return await self._read_selecting(url, response, select)
+
+        with stage("read"):
+            body = await response.read()
+
+        return Response(
+            url,
+            sniff_encoding(response.headers.get("Content-Type"), body),
+            time.time(),
+            response.headers,
+            body,
+            response.status,
+        )
+
+    async def _read_selecting(self, url, response, select):
+        chunk = await response.content.readany()
+        content_type = response.headers.get("Content-Type")
+        encoding = sniff_encoding(content_type, chunk)
+
+        if is_json(content_type, chunk.decode(encoding, "replace")):
+            body = chunk + await response.content.read()
+            return Response(
+                url, encoding, time.time(), response.headers, body, response.status
+            )
+
+        selection = select.select_streamed(encoding)
+
+        with stage("stream"):
+            while chunk:
+                selection.feed(chunk)
+                chunk = await response.content.readany()
+
+        return Response(
+            url,
+            encoding,
+            time.time(),
+            response.headers,
+            status=response.status,
+            documents=selection.close(),
+        )
+
+    def save_context(self, context):
+        if isinstance(context.document, JsonDocument):
+            document = context.document
+            return [context.locator, document.json_text, "json", document.page]
+
+        return super().save_context(context)
+
+    def restore_context(self, locator, text, type="html", page=True):
+        # States saved without the page flag only had pages of JSON.
+        if type == "json":
+            return Context(locator, JsonDocument(text, page=page))
+
+        return Context(locator, Document(text))
 
     def join(self, base, url):
-        return str(URL(base).join(URL(url)))
+        url = str(URL(base).join(URL(url)))
+
+        if self._canonicalize:
+            return self._canonicalize(url)
+
+        return url
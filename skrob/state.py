@@ -0,0 +1,52 @@
+import json
+import time
+import os
+
+
+class CrawlState:
+    """File the progress of a run is periodically saved to, for an interrupted run to be resumed
+    from where it left off instead of starting over. The other files are kept along with it, and
+    removed with it once the run is done."""
+
+    def __init__(self, path, interval=60.0, files=()):
+        self._path = path
+        self._interval = interval
+        self._files = files
+        self._saved = time.monotonic()
+
+    def load(self, script_id):
+        try:
+            with open(self._path) as file:
+                state = json.load(file)
+        except FileNotFoundError:
+            return None
+
+        if state["script"] != script_id:
+            raise ValueError(f"State file {self._path} was saved by a different script")
+
+        return state
+
+    def is_due(self):
+        return time.monotonic() - self._saved >= self._interval
+
+    def save(self, script_id, visited, refollowed, lanes):
+        state = {
+            "script": script_id,
+            "visited": visited,
+            "refollowed": refollowed,
+            "lanes": lanes,
+        }
+
+        # Written aside first so that an interruption while saving keeps the previous state.
+        with open(self._path + ".tmp", "w") as file:
+            json.dump(state, file)
+
+        os.replace(self._path + ".tmp", self._path)
+        self._saved = time.monotonic()
+
+    def remove(self):
+        for path in (self._path, *self._files):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
@@ -0,0 +1,349 @@
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+import json
+import math
+import time
+
+# Stats of the run in progress, for the parts of it that don't know about the run, e.g. documents
+# parsed on first use.
+current_stats = ContextVar("current_stats", default=None)
+
+
+@contextmanager
+def stage(name):
+    """Time a stage of handling a page into the current stats, if any."""
+    stats = current_stats.get()
+
+    if stats is None:
+        yield
+        return
+
+    started = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        stats.stage(name).observe(time.perf_counter() - started)
+
+
+class Histogram:
+    """Counts of durations in seconds, by the smallest of bounds that they don't exceed"""
+
+    bounds = (
+        0.001,
+        0.0025,
+        0.005,
+        0.01,
+        0.025,
+        0.05,
+        0.1,
+        0.25,
+        0.5,
+        1.0,
+        2.5,
+        5.0,
+        10.0,
+        30.0,
+        60.0,
+        math.inf,
+    )
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect_left(self.bounds, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+    def quantile(self, q):
+        """Return the bound of the bucket that the q-quantile is in."""
+        cumulative = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+
+            if cumulative >= q * self.count:
+                return bound
+
+        return math.inf
+
+    def cumulative_counts(self):
+        cumulative = 0
+
+        for bound, count in zip(self.bounds, self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+    def to_json(self):
+        return {
+            "count": self.count,
+            "sum": self.sum,
+            "buckets": {
+                format_bound(bound): count for bound, count in self.cumulative_counts()
+            },
+        }
+
+
+class CommandStats:
+    """Runs of a command of the script: each on a list of contexts for selects and collects, and
+    on a single page for follows"""
+
+    def __init__(self):
+        self.runs = 0
+        self.contexts_in = 0
+        self.contexts_out = 0
+        self.latency = Histogram()
+
+    def record(self, contexts_in, contexts_out, seconds):
+        self.runs += 1
+        self.contexts_in += contexts_in
+        self.contexts_out += contexts_out
+        self.latency.observe(seconds)
+
+
+class HostStats:
+    """Requests to a host. wait is the time until the response's headers, latency until its end."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.bytes = 0
+        self.wait = Histogram()
+        self.latency = Histogram()
+
+
+class Stats:
+    """Counters and latency histograms of a run, by command of the script, stage of handling
+    pages, host and response status.
+
+    Commands are labelled by their position in the script, e.g. 2.0 for the first command in the
+    third, a Block. The stages are:
+
+    - read: reading a response's body,
+    - decode: decoding it to text,
+    - json: parsing JSON,
+    - xml: converting JSON to XML for CSS and XPath,
+    - parse: parsing HTML or XML, which happens in selects, so is part of their latencies,
+    - stream: reading a response's body while selecting from it, with --stream.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.commands = {}
+        self.stages = {}
+        self.hosts = {}
+        self.statuses = Counter()
+
+    def command(self, label):
+        if label not in self.commands:
+            self.commands[label] = CommandStats()
+
+        return self.commands[label]
+
+    def stage(self, name):
+        if name not in self.stages:
+            self.stages[name] = Histogram()
+
+        return self.stages[name]
+
+    def request(self, host, status, wait, latency, size):
+        """Record a request to host. Without a status, e.g. if it raised, it counts as an error."""
+        if host not in self.hosts:
+            self.hosts[host] = HostStats()
+
+        stats = self.hosts[host]
+        stats.requests += 1
+        stats.bytes += size
+        stats.latency.observe(latency)
+        self.statuses[status or "error"] += 1
+
+        if status is None:
+            stats.errors += 1
+        else:
+            stats.wait.observe(wait)
+
+    def format(self, format="text"):
+        if format == "json":
+            return json.dumps(self.to_json(), indent=2) + "\n"
+        elif format == "prometheus":
+            return self.to_prometheus()
+
+        return self.to_text()
+
+    def to_json(self):
+        return {
+            "seconds": time.monotonic() - self.started,
+            "commands": {
+                label: {
+                    "runs": stats.runs,
+                    "contexts_in": stats.contexts_in,
+                    "contexts_out": stats.contexts_out,
+                    "latency": stats.latency.to_json(),
+                }
+                for label, stats in self.commands.items()
+            },
+            "stages": {name: stage.to_json() for name, stage in self.stages.items()},
+            "hosts": {
+                host: {
+                    "requests": stats.requests,
+                    "errors": stats.errors,
+                    "bytes": stats.bytes,
+                    "wait": stats.wait.to_json(),
+                    "latency": stats.latency.to_json(),
+                }
+                for host, stats in self.hosts.items()
+            },
+            "statuses": {str(status): count for status, count in self.statuses.items()},
+        }
+
+    def to_text(self):
+        lines = [f"Run time: {time.monotonic() - self.started:.3f}s", ""]
+        # The quantiles are the bounds of the buckets they are in.
+        quantiles = "{:>10} {:>8} {:>8} {:>8}"
+        lines.append(
+            ("{:32} {:>8} {:>10} {:>10} " + quantiles).format(
+                "Command", "Runs", "In", "Out", "Total s", "p50", "p90", "p99"
+            )
+        )
+
+        for label, stats in self.commands.items():
+            lines.append(
+                ("{:32} {:>8} {:>10} {:>10} " + quantiles).format(
+                    label[:32],
+                    stats.runs,
+                    stats.contexts_in,
+                    stats.contexts_out,
+                    *format_latencies(stats.latency),
+                )
+            )
+
+        lines += [
+            "",
+            ("{:32} {:>8} " + quantiles).format(
+                "Stage", "Count", "Total s", "p50", "p90", "p99"
+            ),
+        ]
+
+        for name, histogram in self.stages.items():
+            lines.append(
+                ("{:32} {:>8} " + quantiles).format(
+                    name, histogram.count, *format_latencies(histogram)
+                )
+            )
+
+        lines += [
+            "",
+            ("{:32} {:>8} {:>8} {:>12} " + quantiles).format(
+                "Host", "Requests", "Errors", "Bytes", "Total s", "p50", "p90", "p99"
+            ),
+        ]
+
+        for host, stats in self.hosts.items():
+            lines.append(
+                ("{:32} {:>8} {:>8} {:>12} " + quantiles).format(
+                    str(host)[:32],
+                    stats.requests,
+                    stats.errors,
+                    stats.bytes,
+                    *format_latencies(stats.latency),
+                )
+            )
+
+        lines += ["", "{:32} {:>8}".format("Status", "Count")]
+
+        for status, count in sorted(self.statuses.items(), key=str):
+            lines.append("{:32} {:>8}".format(str(status), count))
+
+        return "\n".join(lines) + "\n"
+
+    def to_prometheus(self):
+        """Return the stats in the Prometheus text exposition format."""
+        lines = [
+            "# TYPE skrob_run_seconds gauge",
+            f"skrob_run_seconds {time.monotonic() - self.started}",
+        ]
+
+        def counter(name, label, values):
+            lines.append(f"# TYPE {name} counter")
+
+            for value, count in values:
+                lines.append(f"{name}{{{label}={quote(value)}}} {count}")
+
+        def histogram(name, label, histograms):
+            lines.append(f"# TYPE {name} histogram")
+
+            for value, histogram in histograms:
+                labels = f"{label}={quote(value)}"
+
+                for bound, count in histogram.cumulative_counts():
+                    le = quote(format_bound(bound))
+                    lines.append(f"{name}_bucket{{{labels},le={le}}} {count}")
+
+                lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+                lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+        commands = self.commands.items()
+        counter(
+            "skrob_command_contexts_in_total",
+            "command",
+            [(label, stats.contexts_in) for label, stats in commands],
+        )
+        counter(
+            "skrob_command_contexts_out_total",
+            "command",
+            [(label, stats.contexts_out) for label, stats in commands],
+        )
+        histogram(
+            "skrob_command_seconds",
+            "command",
+            [(label, stats.latency) for label, stats in commands],
+        )
+        histogram("skrob_stage_seconds", "stage", self.stages.items())
+
+        hosts = self.hosts.items()
+        counter(
+            "skrob_host_errors_total",
+            "host",
+            [(host, stats.errors) for host, stats in hosts],
+        )
+        counter(
+            "skrob_host_bytes_total",
+            "host",
+            [(host, stats.bytes) for host, stats in hosts],
+        )
+        histogram(
+            "skrob_host_wait_seconds",
+            "host",
+            [(host, stats.wait) for host, stats in hosts],
+        )
+        histogram(
+            "skrob_host_seconds",
+            "host",
+            [(host, stats.latency) for host, stats in hosts],
+        )
+        counter("skrob_responses_total", "status", self.statuses.items())
+        return "\n".join(lines) + "\n"
+
+
+def format_bound(bound):
+    return "+Inf" if bound == math.inf else repr(bound)
+
+
+def format_latencies(histogram):
+    if not histogram.count:
+        return f"{histogram.sum:.3f}", "-", "-", "-"
+
+    return (
+        f"{histogram.sum:.3f}",
+        *(format_bound(histogram.quantile(q)) for q in (0.5, 0.9, 0.99)),
+    )
+
+
+def quote(value):
+    value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+    return f'"{value}"'
@@ -0,0 +1,170 @@
+from abc import ABC, abstractmethod
+import hashlib
+import base64
+import math
+
+
+def digest(locator, size):
+    return hashlib.blake2b(locator.encode(), digest_size=size).digest()
+
+
+class Visited(ABC):
+    """Store of the locators already followed in a run"""
+
+    @abstractmethod
+    def add(self, locator):
+        """Add the locator. Return False if it was already there."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def clear(self):
+        raise NotImplementedError
+
+    @abstractmethod
+    def dump(self):
+        """Return the contents as a JSON-serializable object for load() to restore."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def load(self, data):
+        raise NotImplementedError
+
+    def close(self):
+        """Release the files held open, until the next clear() or load()."""
+        pass
+
+
+class VisitedSet(Visited):
+    """Exact set of the full locators"""
+
+    def __init__(self):
+        self._locators = set()
+
+    def add(self, locator):
+        if locator in self._locators:
+            return False
+
+        self._locators.add(locator)
+        return True
+
+    def clear(self):
+        self._locators = set()
+
+    def dump(self):
+        return list(self._locators)
+
+    def load(self, data):
+        self._locators = set(data)
+
+
+class VisitedDigests(Visited):
+    """Set of fixed-width digests of the locators. With the default 8 bytes, a false match is
+    expected once in about 10^19 / n^2 runs of n locators."""
+
+    def __init__(self, size=8):
+        self._size = size
+        self._digests = set()
+
+    def add(self, locator):
+        key = int.from_bytes(digest(locator, self._size), "big")
+
+        if key in self._digests:
+            return False
+
+        self._digests.add(key)
+        return True
+
+    def clear(self):
+        self._digests = set()
+
+    def dump(self):
+        return list(self._digests)
+
+    def load(self, data):
+        self._digests = set(data)
+
+
+class VisitedBloomFilter(Visited):
+    """Bloom filter of the locators. Up to capacity locators, a new locator is mistaken for a
+    visited one, and so skipped, with a probability of at most error_rate."""
+
+    def __init__(self, capacity=10_000_000, error_rate=1e-4):
+        self._bit_count = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self._hash_count = max(1, round(self._bit_count / capacity * math.log(2)))
+        self._bits = bytearray((self._bit_count + 7) // 8)
+
+    def add(self, locator):
+        # Double hashing, i.e. the k-th probe is at h1 + k * h2.
+        key = digest(locator, 16)
+        h1 = int.from_bytes(key[:8], "big")
+        h2 = int.from_bytes(key[8:], "big") | 1
+        added = False
+
+        for k in range(self._hash_count):
+            bit = (h1 + k * h2) % self._bit_count
+            mask = 1 << (bit & 7)
+
+            if not self._bits[bit >> 3] & mask:
+                self._bits[bit >> 3] |= mask
+                added = True
+
+        return added
+
+    def clear(self):
+        self._bits = bytearray(len(self._bits))
+
+    def dump(self):
+        return base64.b64encode(self._bits).decode()
+
+    def load(self, data):
+        self._bits = bytearray(base64.b64decode(data))
+
+
+class VisitedDatabase(Visited):
+    """Digests of the locators kept in an SQLite database file instead of in memory. With an
+    empty path, the file is a temporary one, removed once the database is closed."""
+
+    def __init__(self, path, size=16):
+        self._path = path
+        self._size = size
+        self._open()
+
+    def _open(self):
+        # Imported here, as most runs don't use it.
+        import sqlite3
+
+        self._connection = sqlite3.connect(self._path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=OFF")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS visited (digest BLOB PRIMARY KEY) WITHOUT ROWID"
+        )
+
+    def add(self, locator):
+        cursor = self._connection.execute(
+            "INSERT OR IGNORE INTO visited VALUES (?)", (digest(locator, self._size),)
+        )
+        return cursor.rowcount == 1
+
+    def clear(self):
+        if not self._connection:
+            self._open()
+
+        self._connection.execute("DELETE FROM visited")
+        self._connection.commit()
+
+    def dump(self):
+        # The database is its own dump. Additions are committed only here, so that after a crash
+        # the file matches the last saved state.
+        self._connection.commit()
+        return None
+
+    def load(self, data):
+        if not self._connection:
+            self._open()
+
+    def close(self):
+        # Additions since the last dump() are rolled back, as after a crash.
+        if self._connection:
+            self._connection.close()
+            self._connection = None
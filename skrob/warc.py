@@ -0,0 +1,275 @@
+from .cache import Response
+from .skrob import sniff_encoding
+from multidict import CIMultiDict
+from datetime import datetime, timezone
+from yarl import URL
+import importlib.metadata
+import io
+import json
+import uuid
+import zlib
+import gzip
+import os
+
+# Headers that don't hold for the bodies as recorded, which aiohttp has decoded and dechunked.
+dropped_headers = {"content-encoding", "transfer-encoding", "content-length"}
+
+# Redirects followed in a replay, as many as aiohttp follows by default.
+max_redirects = 10
+
+
+class NotArchived(LookupError):
+    """The archive has no response for a URL"""
+
+
+class WarcWriter:
+    """Writer of the requests and responses of a run to a WARC file, gzipped record by record if
+    its path ends with .gz, as most tools that read WARC files expect.
+
+    Bodies are recorded as aiohttp decoded them, so the Content-Encoding and Transfer-Encoding
+    headers are left out and Content-Length is set to their decoded size. Redirects are recorded
+    with empty bodies. Alongside the archive, an index of where each response is in it is written
+    to the path with .idx appended, for WarcArchive to look them up by URL.
+    """
+
+    def __init__(self, path):
+        self._compress = path.endswith(".gz")
+        self._file = open(path, "wb")
+        self._index = open(path + ".idx", "w")
+
+        fields = (
+            f"software: Skrob {importlib.metadata.version('skrob')}\r\n"
+            "format: WARC File Format 1.1\r\n"
+        )
+        self._write(
+            {
+                "WARC-Type": "warcinfo",
+                "WARC-Filename": os.path.basename(path),
+                "Content-Type": "application/warc-fields",
+            },
+            fields.encode(),
+        )
+
+    def record(self, response, body):
+        """Record the aiohttp response with the body read from it, and the redirects that led to
+        it."""
+        for redirect in response.history:
+            self._record_exchange(redirect, b"")
+
+        self._record_exchange(response, body)
+
+    def close(self):
+        self._file.close()
+        self._index.close()
+
+    def _record_exchange(self, response, body):
+        request_info = response.request_info
+        url = URL(request_info.url)
+        headers = CIMultiDict(request_info.headers)
+        headers.setdefault("Host", url.raw_host or "")
+        request = [f"{request_info.method} {url.raw_path_qs} HTTP/1.1"]
+        request += [f"{name}: {value}" for name, value in headers.items()]
+
+        version = response.version or (1, 1)
+        status_line = (
+            f"HTTP/{version[0]}.{version[1]} {response.status} {response.reason or ''}"
+        )
+        lines = [status_line.rstrip()]
+        lines += [
+            f"{name.decode('latin-1')}: {value.decode('latin-1')}"
+            for name, value in response.raw_headers
+            if name.decode("latin-1").lower() not in dropped_headers
+        ]
+        lines.append(f"Content-Length: {len(body)}")
+
+        target = str(url.with_fragment(None))
+        response_id = new_record_id()
+        offset = self._write(
+            {
+                "WARC-Type": "response",
+                "WARC-Record-ID": response_id,
+                "WARC-Target-URI": target,
+                "Content-Type": "application/http;msgtype=response",
+            },
+            to_http_block(lines) + body,
+        )
+        self._index.write(json.dumps({"url": target, "offset": offset}) + "\n")
+        self._write(
+            {
+                "WARC-Type": "request",
+                "WARC-Target-URI": target,
+                "WARC-Concurrent-To": response_id,
+                "Content-Type": "application/http;msgtype=request",
+            },
+            to_http_block(request),
+        )
+
+    def _write(self, fields, block):
+        """Write a record with the named fields and block, and return its offset."""
+        fields = {
+            "WARC-Record-ID": new_record_id(),
+            "WARC-Date": datetime.now(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            **fields,
+            "Content-Length": len(block),
+        }
+        header = "WARC/1.1\r\n" + "".join(
+            f"{name}: {value}\r\n" for name, value in fields.items()
+        )
+        record = header.encode() + b"\r\n" + block + b"\r\n\r\n"
+
+        if self._compress:
+            record = gzip.compress(record)
+
+        offset = self._file.tell()
+        self._file.write(record)
+        return offset
+
+
+class WarcArchive:
+    """WARC file, gzipped record by record or not, to look up responses in by URL, e.g. to run
+    scripts on the pages that a WarcWriter recorded without fetching them again.
+
+    The index that WarcWriter writes alongside is used to find the responses. Without it, the
+    archive is read through once to index it. Of responses to the same URL, the last is used.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "rb")
+        self._compressed = self._file.read(2) == b"\x1f\x8b"
+        self._offsets = {}
+
+        try:
+            with open(path + ".idx") as index:
+                for line in index:
+                    entry = json.loads(line)
+                    self._offsets[entry["url"]] = entry["offset"]
+        except FileNotFoundError:
+            self._scan()
+
+    def load(self, url):
+        """Return the response to url, after the redirects that were recorded, if any."""
+        key = to_key(url)
+
+        for _ in range(max_redirects + 1):
+            if key not in self._offsets:
+                raise NotArchived(key)
+
+            self._file.seek(self._offsets[key])
+            fields, block = self._read_record()
+            response = to_response(url, fields, block)
+
+            location = response.headers.get("Location")
+
+            if not 300 <= response.status < 400 or not location:
+                return response
+
+            key = to_key(URL(key).join(URL(location)))
+
+        raise NotArchived(f"{url}: too many redirects")
+
+    def close(self):
+        self._file.close()
+
+    def _scan(self):
+        self._file.seek(0)
+
+        while True:
+            offset = self._file.tell()
+            record = self._read_record()
+
+            if record is None:
+                break
+
+            fields, _ = record
+
+            if fields.get("WARC-Type") == "response" and "WARC-Target-URI" in fields:
+                self._offsets[to_key(fields["WARC-Target-URI"])] = offset
+
+    def _read_record(self):
+        """Read the record at the file's position, leaving it at the next one. Return its fields
+        and block, or None at the end of the file."""
+        if not self._compressed:
+            return read_record(self._file)
+
+        decompressor = zlib.decompressobj(zlib.MAX_WBITS | 16)
+        data = []
+
+        while not decompressor.eof:
+            chunk = self._file.read(1 << 16)
+
+            if not chunk:
+                break
+
+            data.append(decompressor.decompress(chunk))
+
+        # Back to the end of the member, where the next record starts.
+        self._file.seek(-len(decompressor.unused_data), os.SEEK_CUR)
+
+        if not data:
+            return None
+
+        return read_record(io.BytesIO(b"".join(data)))
+
+
+def read_record(file):
+    line = file.readline()
+
+    # Records are separated by blank lines.
+    while line in (b"\r\n", b"\n"):
+        line = file.readline()
+
+    if not line:
+        return None
+
+    if not line.startswith(b"WARC/"):
+        raise ValueError(f"Not a WARC record: {line[:40]!r}")
+
+    fields = {}
+
+    for line in iter(file.readline, b""):
+        if not line.strip():
+            break
+
+        name, _, value = line.decode("utf-8").partition(":")
+        fields[name.strip()] = value.strip()
+
+    block = file.read(int(fields.get("Content-Length", 0)))
+    return fields, block
+
+
+def to_response(url, fields, block):
+    """Parse a response record's fields and HTTP block into a Response to url."""
+    head, _, body = block.partition(b"\r\n\r\n")
+    status_line, *header_lines = head.decode("latin-1").split("\r\n")
+    headers = CIMultiDict()
+
+    for line in header_lines:
+        name, _, value = line.partition(":")
+        headers.add(name.strip(), value.strip())
+
+    try:
+        date = fields["WARC-Date"].replace("Z", "+00:00")
+        stored = datetime.fromisoformat(date).timestamp()
+    except (KeyError, ValueError):
+        stored = 0.0
+
+    return Response(
+        url,
+        sniff_encoding(headers.get("Content-Type"), body),
+        stored,
+        headers,
+        body,
+        int(status_line.split()[1]),
+    )
+
+
+def to_http_block(lines):
+    return "".join(line + "\r\n" for line in lines).encode("latin-1") + b"\r\n"
+
+
+def to_key(url):
+    return str(URL(url).with_fragment(None))
+
+
+def new_record_id():
+    return f"<urn:uuid:{uuid.uuid4()}>"
@@ -1,5 +1,16 @@
+from skrob import Context, JsonDocument, Skrob
+from skrob.skrob import parse
 import skrob.cli
 import pytest
+import asyncio
+import codecs
+import json
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from io import StringIO
 
 
@@ -42,6 +53,136 @@ def run_up_to_writes(argv, count):
         assert wrapped_stream.counter == count
 
 
+def run_on_document(argv, document, monkeypatch):
+    monkeypatch.setattr("sys.stdin", StringIO(document))
+
+    with StringIO() as output_stream:
+        skrob.cli.run(["skrob"] + argv, output_stream)
+        return output_stream.getvalue()
+
+
+posts = """
+<html><body>
+<div class="post"><a href="/1">One</a></div>
+<div class="post"><a href="/2">Two</a></div>
+</body></html>
+"""
+
+
+class Site:
+    """Pages served by serve_pages(), and the requests and connections made for them"""
+
+    def __init__(self, pages, delay):
+        self.pages = pages
+        self.delay = delay
+        self.url = None
+        self.requests = []
+        self.times = []
+        self.connections = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+
+@contextmanager
+def serve_pages(pages, delay=0.0):
+    """Serve the pages, by path, locally, and yield their Site, with the server's URL.
+
+    A page is either the HTML text of a 200 response, or a function of the request handler that
+    returns the response's status, headers and body, or None to close the connection instead.
+    Each response is delayed by delay seconds."""
+
+    site = Site(pages, delay)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+
+            with site.lock:
+                site.connections += 1
+
+        def do_GET(self):
+            with site.lock:
+                site.requests.append(self.path)
+                site.times.append(time.monotonic())
+                site.in_flight += 1
+                site.max_in_flight = max(site.max_in_flight, site.in_flight)
+
+            try:
+                time.sleep(site.delay)
+                self.respond(site.pages.get(self.path, (404, {}, b"")))
+            finally:
+                with site.lock:
+                    site.in_flight -= 1
+
+        def respond(self, page):
+            if callable(page):
+                page = page(self)
+
+            if page is None:
+                self.close_connection = True
+                return
+
+            if isinstance(page, str):
+                page = (
+                    200,
+                    {"Content-Type": "text/html; charset=utf-8"},
+                    page.encode(),
+                )
+
+            status, headers, body = page
+            self.send_response(status)
+
+            for name, value in headers.items():
+                self.send_header(name, value)
+
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    server.daemon_threads = True
+    # Runs stopped early leave responses unread.
+    server.handle_error = lambda request, client_address: None
+    site.url = f"http://127.0.0.1:{server.server_address[1]}"
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+
+    try:
+        yield site
+    finally:
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+
+def run_then_output(argv):
+    """Run, leaving out the logs and the URLs followed, and return the output."""
+    with StringIO() as output_stream:
+        skrob.cli.run(["skrob"] + argv, output_stream, StringIO(), None, StringIO())
+        return output_stream.getvalue()
+
+
+thread_pages = {
+    "/1": """
+    <html><body>
+    <div class="content">One</div><div class="content">Two</div>
+    <a rel="next" href="/2">Next</a>
+    </body></html>
+    """,
+    "/2": """
+    <html><body>
+    <div class="content">Three</div><div class="content">Four</div>
+    </body></html>
+    """,
+}
+
+
 def test_phpbb_html_thread():
     run_then_count(
         [
@@ -58,6 +199,310 @@ def test_phpbb_html_thread():
     )
 
 
+def test_html_thread_workers():
+    code = "{ .content; a[rel='next']::attr(href) -> } !;"
+
+    with serve_pages(thread_pages) as site:
+        output = run_then_output([code, site.url + "/1"])
+        assert output.count('class="content"') == 4
+        assert run_then_output(["-j", "2", code, site.url + "/1"]) == output
+
+
+def test_html_distributed(tmp_path):
+    fetched = []
+
+    def page(i):
+        # Linking to the next page on the other host, for it to be passed between the workers
+        # of the hosts, and back to the previous one on the same host.
+        def respond(handler):
+            host, port = handler.headers["Host"].split(":")
+            other = {"127.0.0.1": "localhost", "localhost": "127.0.0.1"}[host]
+            fetched.append((host, i))
+            return (
+                f'<p>Page {i}</p><a href="http://{other}:{port}/{i + 1}">Next</a>'
+                f'<a href="/{max(i - 1, 0)}">Previous</a>'
+            )
+
+        return respond
+
+    code = "{ p::text; a::attr(href) -> } !;"
+
+    with serve_pages({f"/{i}": page(i) for i in range(6)}) as site:
+        argv = ["--distribute", "2", "--frontier", str(tmp_path / "frontier.db")]
+        output = run_then_output(argv + [code, site.url + "/0"])
+        distributed = fetched[:]
+        del fetched[:]
+        single = run_then_output([code, site.url + "/0"])
+
+    assert sorted(output.splitlines()) == sorted(single.splitlines())
+    # Each page on each host once, whichever worker came across it.
+    assert sorted(distributed) == sorted(set(fetched))
+    assert len(distributed) == 12
+
+
+def test_html_canonicalized():
+    links = "".join(
+        f'<a href="{url}">{url}</a>'
+        for url in ["/p?b=2&a=1&sid=x", "/p?a=1&b=2#top", "/p?utm_source=z&a=1&b=2"]
+    )
+
+    with serve_pages({"/": links, "/p?a=1&b=2": "<p>P</p>"}) as site:
+        argv = ["--canonicalize", "a::attr(href) -> p::text;", site.url]
+
+        # Followed once, at the canonical URL.
+        assert run_then_output(argv) == "P\n"
+        assert site.requests == ["/", "/p?a=1&b=2"]
+
+
+def test_html_dedup_bodies():
+    pages = {
+        "/": '<a href="/a">a</a><a href="/b">b</a><a href="/c">c</a>',
+        "/a": "<p>Same</p>",
+        "/b": "<p>Same</p>",
+        "/c": "<p>Other</p>",
+    }
+
+    with serve_pages(pages) as site:
+        code = "a::attr(href) -> p::text;"
+        assert run_then_output([code, site.url]) == "Same\nSame\nOther\n"
+        assert run_then_output(["--dedup-bodies", code, site.url]) == "Same\nOther\n"
+
+
+def test_html_thread_replayed(tmp_path):
+    code = "{ .content; a[rel='next']::attr(href) -> } !;"
+    archive = str(tmp_path / "thread.warc.gz")
+
+    with serve_pages(thread_pages) as site:
+        url = site.url + "/1"
+        output = run_then_output(["--record", archive, code, url])
+
+    assert output.count('class="content"') == 4
+    # Replayed with the server gone.
+    assert run_then_output(["--replay", archive, code, url]) == output
+
+
+def test_html_budget():
+    code = "{ p::text; a::attr(href) -> } !;"
+
+    with serve_pages(chained_pages) as site:
+        for limit in ["--max-results", "--max-pages", "--max-depth"]:
+            output = run_then_output([limit, "2", code, site.url + "/0"])
+            assert output == "Page 0\nPage 1\n", limit
+
+        del site.requests[:]
+        run_then_output(["--max-pages", "2", code, site.url + "/0"])
+        assert site.requests == ["/0", "/1"]
+
+    with serve_pages(chained_pages, delay=0.3) as site:
+        # Stopped while following the second page.
+        output = run_then_output(["--max-time", "0.45", code, site.url + "/0"])
+        assert output == "Page 0\n"
+
+
+def test_html_budget_resumed(tmp_path):
+    code = "{ p::text; a::attr(href) -> } !;"
+    state = tmp_path / "state"
+
+    with serve_pages(chained_pages) as site:
+        argv = ["--state", str(state), "--state-interval", "0", code, site.url + "/0"]
+        assert run_then_output(["--max-results", "2"] + argv) == "Page 0\nPage 1\n"
+        # Stopped early, with the state to go on from.
+        assert state.exists()
+        del site.requests[:]
+
+        output = run_then_output(argv)
+        assert output.endswith("Page 2\nPage 3\n")
+        assert "/0" not in site.requests and "/1" not in site.requests
+        assert not state.exists()
+
+
+def test_explain_fused_selects():
+    run_then_count(
+        [
+            "--explain",
+            """
+            {
+                .content
+                %.%
+                p;
+                a[rel='next']::attr(href) ->
+            } !;
+            """,
+        ],
+        "fused select",
+        1,
+    )
+
+
+def test_explain_batch_rejected():
+    with pytest.raises(SystemExit):
+        skrob.cli.run(["skrob", "--explain", "--batch"], StringIO())
+
+
+def test_html_parts_selected_as_reparsed(monkeypatch):
+    # Parts of pages are selected from as the pages that their text parses to.
+    cases = {
+        "%.%": '<html><body><div class="post"><a href="/1">One</a></div></body></html>\n',
+        "%a/@href%": "",
+        "%./div%": "",
+        "%count(*)%": "1.0\n",
+        "%name(.)%": "html\n",
+        "%self::div%": "",
+        "%text()%": "",
+        "%/html/body/div[1]%": '<div class="post"><a href="/1">One</a></div>\n',
+        "%split(//a, 1)%": '<chunk><a href="/1">One</a></chunk>\n',
+        "a::attr(href)": "/1\n",
+        "%./body/div/a/@href%": "/1\n",
+    }
+
+    for select, output in cases.items():
+        argv = [f"%(//div[@class='post'])[1]% {select};"]
+        assert run_on_document(argv, posts, monkeypatch) == output, select
+
+
+def test_html_parts_selected_in_workers(monkeypatch):
+    # Parts of pages sent to worker processes are selected from as they are in-process.
+    for code in [
+        ".post { %a/@href%; }",
+        ".post %name(.)%;",
+        ".post\na::attr(href);",
+        ".post { a; %..%; }",
+    ]:
+        in_process = run_on_document([code], posts, monkeypatch)
+        assert run_on_document(["-j", "2", code], posts, monkeypatch) == in_process
+
+    # Collected in the order of the document, however long each part takes to select from.
+    many_posts = "".join(
+        f'<div class="post"><a href="/{i}">{i}</a></div>' for i in range(16)
+    )
+    output = "".join(f'<a href="/{i}">{i}</a>\n' for i in range(16))
+    assert (
+        run_on_document(["-j", "2", ".post { a; }"], many_posts, monkeypatch) == output
+    )
+
+
+def test_css_ampersands(monkeypatch):
+    # Ampersands in attribute selectors and strings are CSS, elsewhere they delimit JMESPath.
+    document = '<a href="/t?id=1">1</a><a href="/t?id=1&page=2">2</a>'
+
+    for code in ["a[href*='&page=']::attr(href);", 'a[href$="&page=2"]::attr(href);']:
+        assert run_on_document([code], document, monkeypatch) == "/t?id=1&page=2\n"
+
+    document = '{"a": {"b": "x&y"}}'
+    assert run_on_document(["&a.b&;"], document, monkeypatch) == "x&y\n"
+
+
+def test_parsed():
+    assert repr(parse("{ .a; %a[@b='\\%']% -> }\n&'b\\&'& ;")) == (
+        "[Block(commands=[CssSelect(query='.a'), Collect(), "
+        "XpathSelect(query=\"a[@b='\\\\%']\"), Follow()]), "
+        "JmespathSelect(query=\"'b&'\"), Collect()]"
+    )
+
+    for code, error in [
+        ("{ a;", "Unmatched '{' at line 1, column 1"),
+        ("a; }", "Unmatched '}' at line 1, column 4"),
+        ("p\n  %x", "Unmatched '%' at line 2, column 3"),
+    ]:
+        with pytest.raises(ValueError, match=error):
+            parse(code)
+
+
+def test_help_imports_lazily():
+    # The command line's help doesn't wait for the modules that running a script needs.
+    code = """
+import sys, skrob.cli
+try:
+    skrob.cli.run(["skrob", "--help"])
+except SystemExit:
+    pass
+print(sorted({"aiohttp", "lxml", "parsel", "jmespath"} & set(sys.modules)))
+"""
+    process = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+    assert process.stdout.splitlines()[-1] == "[]"
+
+
+def test_encodings_sniffed():
+    def page(content_type, body):
+        return 200, {"Content-Type": content_type}, body
+
+    pages = {
+        # Declared by a meta element, or by the header over it.
+        "/meta": page(
+            "text/html",
+            '<meta charset="windows-1250"><p>Łódź</p>'.encode("windows-1250"),
+        ),
+        "/header": page(
+            "text/html; charset=utf-8",
+            '<meta charset="iso-8859-2"><p>Łódź</p>'.encode(),
+        ),
+        # Byte order marks, over the header.
+        "/utf-16": page(
+            "text/html", codecs.BOM_UTF16_LE + "<p>Łódź</p>".encode("utf-16-le")
+        ),
+        "/utf-8": page(
+            "text/html; charset=iso-8859-1",
+            codecs.BOM_UTF8 + "<p>Łódź</p>".encode(),
+        ),
+        "/json": page("application/json", codecs.BOM_UTF8 + '{"p": "Łódź"}'.encode()),
+    }
+
+    with serve_pages(pages) as site:
+        for path in pages:
+            code = "&p&;" if path == "/json" else "p::text;"
+
+            for argv in ([code, site.url + path], ["--stream", code, site.url + path]):
+                assert run_then_output(argv) == "Łódź\n", argv
+
+
+def test_undecodable_bytes_replaced():
+    pages = {
+        "/": (200, {"Content-Type": "text/html"}, b"<p>\xc5\x81\xff\xf3d\xc5\xba</p>")
+    }
+
+    with serve_pages(pages) as site:
+        for argv in (["p::text;", site.url], ["--stream", "p::text;", site.url]):
+            assert run_then_output(argv) == "Ł\ufffd\ufffddź\n"
+
+
+def test_json_value_saved_and_restored():
+    interpreter = Skrob(";", None, None)
+    page = Context("https://example.com/a.json", JsonDocument('{"a": 1}', page=True))
+    value = Context("https://example.com/a.json", JsonDocument(value={"a": 1}))
+
+    for context in (page, value):
+        saved = json.loads(json.dumps(interpreter.save_context(context)))
+        restored = interpreter.restore_context(*saved)
+        assert restored.text == context.text
+
+    assert value.text == '{"a": 1}'
+
+
+def test_html_thread_stream():
+    with serve_pages(thread_pages) as site:
+        for code in ["div.content;", "div.content::text;", "%//div/text()%;"]:
+            argv = [code, site.url + "/1", site.url + "/2"]
+            output = run_then_output(argv)
+            assert output.count("One") == output.count("Four") == 1
+            assert run_then_output(["--stream"] + argv) == output
+
+
+def test_html_thread_stream_collect():
+    # The commands after a Collect run on the pages, not on what was selected while streaming.
+    code = ".content; a[rel='next']::attr(href) -> .content;"
+
+    with serve_pages(thread_pages) as site:
+        argv = [code, site.url + "/1"]
+
+        with StringIO() as buffered_stream, StringIO() as streamed_stream:
+            skrob.cli.run(["skrob"] + argv, buffered_stream)
+            skrob.cli.run(["skrob", "--stream"] + argv, streamed_stream)
+            assert buffered_stream.getvalue().count('class="content"') == 4
+            assert streamed_stream.getvalue() == buffered_stream.getvalue()
+
+
 def test_phpbb_html_subforum():
     # Note: the number of topics PhpBB shows is different than the number of extracted ones. This
     # may either be a bug or some threads or posts may be just hidden.
@@ -79,6 +524,338 @@ def test_phpbb_html_subforum():
     )
 
 
+linked_pages = {
+    "/": "".join(f'<a href="/{i}">{i}</a>' for i in range(8)),
+    **{f"/{i}": f"<p>Page {i}</p>" for i in range(8)},
+}
+
+
+def test_html_follows_window():
+    with serve_pages(linked_pages, delay=0.05) as site:
+        output = run_then_output(["-w", "2", "a::attr(href) -> p::text;", site.url])
+
+    assert output == "".join(f"Page {i}\n" for i in range(8))
+    assert site.max_in_flight == 2
+
+
+def test_html_follows_unordered():
+    with serve_pages(linked_pages, delay=0.05) as site:
+        argv = ["--unordered", "-w", "8", "a::attr(href) -> p::text;", site.url]
+        output = run_then_output(argv)
+
+    assert sorted(output.splitlines()) == [f"Page {i}" for i in range(8)]
+    # Bounded by the 4 connections per host by default.
+    assert site.max_in_flight == 4
+
+
+def test_follow_failure_cancels_others():
+    cancelled = []
+
+    class FailingSkrob(Skrob):
+        async def follow(self, session, url):
+            if url == "/fail":
+                raise ValueError(url)
+
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(url)
+                raise
+
+    async def run():
+        interpreter = FailingSkrob("a::attr(href) ->", None, None)
+
+        with pytest.raises(ValueError):
+            await interpreter.run(
+                '<a href="/1"></a><a href="/fail"></a><a href="/2"></a>'
+            )
+
+        # Cancelled by the time the failure is raised, not left running in the session.
+        return sorted(cancelled)
+
+    assert asyncio.run(run()) == ["/1", "/2"]
+
+
+chained_pages = {
+    f"/{i}": f'<p>Page {i}</p><a href="/{i + 1}">Next</a>' for i in range(4)
+}
+
+
+class FlushLog(StringIO):
+    """An output stream that records how many lines were written by each flush"""
+
+    def __init__(self):
+        super().__init__()
+        self.flushed = []
+
+    def flush(self):
+        self.flushed.append(self.getvalue().count("\n"))
+        super().flush()
+
+
+def run_then_flushes(argv):
+    """Run, with the pages printed one by one, and return the line counts flushed."""
+    with serve_pages(chained_pages, delay=0.1) as site:
+        output_stream = FlushLog()
+        code = "{ p::text; a::attr(href) -> } !;"
+        skrob.cli.run(
+            ["skrob"] + argv + [code, site.url + "/0"],
+            output_stream,
+            StringIO(),
+            None,
+            StringIO(),
+        )
+
+    assert output_stream.getvalue() == "".join(f"Page {i}\n" for i in range(4))
+    return output_stream.flushed
+
+
+def test_output_line_buffered():
+    assert run_then_flushes(["--line-buffered"])[:4] == [1, 2, 3, 4]
+
+
+def test_output_flush_interval():
+    # Lines wait in the buffer for up to the interval, and are all flushed by the end.
+    assert run_then_flushes(["--flush-interval", "10"]) == [4]
+    flushed = run_then_flushes(["--flush-interval", "0.05"])
+    assert flushed[0] < 4 and flushed[-1] == 4
+
+
+def test_cache_hit(tmp_path):
+    with serve_pages(linked_pages) as site:
+        argv = ["--cache-dir", str(tmp_path), "a::attr(href) -> p::text;", site.url]
+        output = run_then_output(argv)
+        del site.requests[:]
+
+        # Fresh pages are reused without asking the server.
+        assert run_then_output(argv) == output
+        assert site.requests == []
+
+
+def test_cache_revalidated(tmp_path):
+    statuses = []
+
+    def page(handler):
+        if handler.headers.get("If-None-Match") == '"v1"':
+            statuses.append(304)
+            return 304, {"ETag": '"v1"'}, b""
+
+        statuses.append(200)
+        headers = {"Content-Type": "text/html", "ETag": '"v1"'}
+        return 200, headers, b"<p>Cached</p>"
+
+    with serve_pages({"/": page}) as site:
+        argv = ["--cache-dir", str(tmp_path), "--cache-ttl", "0", "p::text;", site.url]
+
+        # Stale pages are asked for again, and reused if the server says they are unchanged.
+        assert run_then_output(argv) == "Cached\n"
+        assert run_then_output(argv) == "Cached\n"
+        assert statuses == [200, 304]
+
+
+def test_cache_evicted(tmp_path):
+    pages = {
+        "/": linked_pages["/"],
+        **{f"/{i}": f"<p>Page {i}</p>".ljust(1000) for i in range(8)},
+    }
+
+    with serve_pages(pages) as site:
+        # Room for about 3 of the pages.
+        argv = ["--cache-dir", str(tmp_path), "--cache-size", "0.003"]
+        argv += ["a::attr(href) -> p::text;", site.url]
+        output = run_then_output(argv)
+        bodies = list(tmp_path.glob("*.body"))
+        assert sum(body.stat().st_size for body in bodies) <= 0.003 * 1024 * 1024
+        assert 0 < len(bodies) < len(pages)
+        del site.requests[:]
+
+        # Evicted pages are downloaded again.
+        assert run_then_output(argv) == output
+        assert len(site.requests) == len(pages) - len(bodies)
+
+
+def test_state_resumed(tmp_path):
+    failing = True
+
+    def page(handler):
+        return None if failing else chained_pages["/2"]
+
+    with serve_pages({**chained_pages, "/2": page}) as site:
+        argv = ["--state", str(tmp_path / "state"), "--state-interval", "0"]
+        argv += ["--visited", "database", "--retries", "0"]
+        argv += ["{ p::text; a::attr(href) -> } !;", site.url + "/0"]
+
+        with pytest.raises(Exception):
+            run_then_output(argv)
+
+        assert sorted(path.name for path in tmp_path.iterdir()) == ["state", "state.db"]
+        failing = False
+        del site.requests[:]
+
+        # Resumed from the last page reached, without following the ones before it again.
+        output = run_then_output(argv)
+        assert "Page 2\nPage 3\n" in output
+        assert "/0" not in site.requests and "/1" not in site.requests
+        # Done, with nothing left to resume from.
+        assert list(tmp_path.iterdir()) == []
+
+
+def test_politeness_rate():
+    with serve_pages(linked_pages) as site:
+        run_then_output(["--rate", "20", "a::attr(href) -> p::text;", site.url])
+
+    # The 9 requests take 8 intervals of 1/20s at least.
+    assert site.times[-1] - site.times[0] >= 0.35
+
+
+def test_politeness_concurrency():
+    with serve_pages(linked_pages, delay=0.05) as site:
+        run_then_output(["-n", "2", "-w", "8", "a::attr(href) -> p::text;", site.url])
+
+    assert site.max_in_flight == 2
+
+
+def test_politeness_retry_after():
+    throttled = []
+
+    def page(handler):
+        if not throttled:
+            throttled.append(handler.path)
+            return 429, {"Retry-After": "0.5"}, b""
+
+        return linked_pages["/0"]
+
+    with serve_pages({**linked_pages, "/0": page}) as site:
+        argv = ["-w", "1", "--retries", "0", "a::attr(href) -> p::text;", site.url]
+        assert run_then_output(argv) == "".join(f"Page {i}\n" for i in range(1, 8))
+
+    # The host is left alone for as long as it asked, not only the throttled URL.
+    assert site.requests[1:3] == ["/0", "/1"]
+    assert site.times[2] - site.times[1] >= 0.45
+
+
+def run_then_logs(argv):
+    """Run, leaving out the URLs followed, and return the output and the logs."""
+    with StringIO() as output_stream, StringIO() as log_stream:
+        skrob.cli.run(["skrob"] + argv, output_stream, log_stream, None, StringIO())
+        return output_stream.getvalue(), log_stream.getvalue()
+
+
+def failing_page(path, failures, failure):
+    """Return the page at path of linked_pages, that responds with failure instead the first
+    failures times it is asked for."""
+    requests = []
+
+    def page(handler):
+        requests.append(handler.path)
+
+        if len(requests) <= failures:
+            return failure(handler) if callable(failure) else failure
+
+        return linked_pages[path]
+
+    return page
+
+
+def cut_short(handler):
+    """Respond with less of the body than announced, then close the connection."""
+    handler.send_response(200)
+    handler.send_header("Content-Length", "100")
+    handler.end_headers()
+    handler.wfile.write(b"<p>")
+
+
+def test_retried():
+    pages = {
+        **linked_pages,
+        "/0": failing_page("/0", 1, (503, {}, b"")),
+        "/1": failing_page("/1", 1, cut_short),
+    }
+
+    with serve_pages(pages) as site:
+        argv = ["--retry-backoff", "0", "a::attr(href) -> p::text;", site.url]
+        output, logs = run_then_logs(argv)
+
+    # Both a failed response and one cut short are retried.
+    assert output == "".join(f"Page {i}\n" for i in range(8))
+    assert site.requests.count("/0") == 2
+    assert logs.count("Retrying") == 2
+
+
+def test_retried_then_skipped():
+    pages = {**linked_pages, "/0": failing_page("/0", 3, (503, {}, b""))}
+
+    with serve_pages(pages) as site:
+        argv = ["--retries", "2", "--retry-backoff", "0", "--skip-errors"]
+        output, logs = run_then_logs(argv + ["a::attr(href) -> p::text;", site.url])
+
+    assert output == "".join(f"Page {i}\n" for i in range(1, 8))
+    assert site.requests.count("/0") == 3
+    assert "Skipping" in logs
+
+
+def test_invalid_url_not_retried():
+    links = '<a href="mailto:a@example.com">a</a><a href="/0">0</a>'
+    pages = {**linked_pages, "/": links}
+
+    with serve_pages(pages) as site:
+        # Retrying would wait for the backoff first, for nothing.
+        start = time.monotonic()
+        argv = ["--skip-errors", "a::attr(href) -> p::text;", site.url]
+        output, logs = run_then_logs(argv)
+
+    assert output == "Page 0\n"
+    assert "Retrying" not in logs and "Skipping mailto:a@example.com" in logs
+    assert time.monotonic() - start < 1
+
+
+def test_connections_reused():
+    code = "a::attr(href) -> p::text;"
+
+    with serve_pages(linked_pages) as site:
+        run_then_output(["-w", "1", code, site.url])
+        assert site.connections == 1
+        site.connections = 0
+        run_then_output(["-w", "1", "--keepalive-timeout", "0", code, site.url])
+        assert site.connections == len(linked_pages)
+
+
+def test_hosts_resolved():
+    with serve_pages(linked_pages) as site:
+        url = site.url.replace("127.0.0.1", "skrob.invalid")
+        argv = [
+            "--resolve",
+            "skrob.invalid:127.0.0.1",
+            "a::attr(href) -> p::text;",
+            url,
+        ]
+        assert run_then_output(argv) == "".join(f"Page {i}\n" for i in range(8))
+
+
+def test_stats(tmp_path):
+    path = tmp_path / "stats.json"
+
+    with serve_pages({**linked_pages, "/3": (404, {}, b"")}) as site:
+        argv = ["--stats", "--stats-format", "json", "--stats-file", str(path)]
+        run_then_output(argv + ["a::attr(href) -> p::text;", site.url])
+
+    stats = json.loads(path.read_text())
+    counts = {
+        label: (command["runs"], command["contexts_in"], command["contexts_out"])
+        for label, command in stats["commands"].items()
+    }
+    assert counts == {
+        "initial ->": (1, 1, 1),
+        "0 a::attr(href)": (1, 1, 8),
+        "1 ->": (8, 8, 8),
+        "2 p::text": (1, 8, 7),
+        "3 ;": (1, 7, 7),
+    }
+    assert stats["hosts"]["127.0.0.1"]["requests"] == 9
+    assert stats["hosts"]["127.0.0.1"]["latency"]["count"] == 9
+    assert stats["statuses"] == {"200": 8, "404": 1}
+
+
 def test_hackernews_json_thread_upward():
     run_then_compare(
         [
@@ -105,6 +882,122 @@ def test_hackernews_json_thread_upward():
     )
 
 
+def test_hackernews_json_thread_upward_jmespath():
+    run_then_compare(
+        [
+            """
+            {
+                &id&;
+                &by&;
+                &parent& %concat('https://hacker-news.firebaseio.com/v0/item/', ., '.json')% ->
+            } {
+                &url&;
+            } !;
+            """,
+            "https://hacker-news.firebaseio.com/v0/item/1079.json",
+        ],
+        "1079\n"
+        "dmon\n"
+        "17\n"
+        "pg\n"
+        "15\n"
+        "sama\n"
+        "1\n"
+        "pg\n"
+        "http://ycombinator.com\n",
+    )
+
+
+def test_hackernews_json_thread_upward_iter():
+    async def collect():
+        bcfs = skrob.Skrob(
+            """
+            {
+                id::text;
+                parent %concat('https://hacker-news.firebaseio.com/v0/item/', ., '.json')% ->
+            } !;
+            """,
+            url_stream=None,
+        )
+        return [
+            context.text
+            async for context in bcfs.iter(
+                ["https://hacker-news.firebaseio.com/v0/item/1079.json"], max_pending=1
+            )
+        ]
+
+    assert asyncio.run(collect()) == ["1079", "17", "15", "1"]
+
+
+def test_hackernews_json_thread_upward_batch(monkeypatch):
+    job = {
+        "id": "upward",
+        "code": """
+            {
+                id::text;
+                parent %concat('https://hacker-news.firebaseio.com/v0/item/', ., '.json')% ->
+            } !;
+            """,
+        "urls": ["https://hacker-news.firebaseio.com/v0/item/1079.json"],
+    }
+    monkeypatch.setattr("sys.stdin", StringIO(json.dumps(job) + "\n"))
+
+    with StringIO() as output_stream:
+        skrob.cli.run(["skrob", "--batch"], output_stream)
+        lines = [json.loads(line) for line in output_stream.getvalue().splitlines()]
+
+    assert lines == [
+        {"id": "upward", "text": "1079"},
+        {"id": "upward", "text": "17"},
+        {"id": "upward", "text": "15"},
+        {"id": "upward", "text": "1"},
+        {"id": "upward", "done": True, "results": 4},
+    ]
+
+
+json_items = {
+    f"/item/{id}.json": (
+        200,
+        {"Content-Type": "application/json"},
+        json.dumps(item).encode(),
+    )
+    for id, item in {
+        3: {"id": 3, "by": "c", "parent": 2},
+        2: {"id": 2, "by": "b", "parent": 1},
+        1: {"id": 1, "by": "a", "url": "http://example.com"},
+    }.items()
+}
+
+
+def test_json_thread_upward_jmespath():
+    code = """
+    {
+        &id&;
+        &by&;
+        &parent& %concat('/item/', ., '.json')% ->
+    } {
+        &url&;
+    } !;
+    """
+
+    with serve_pages(json_items) as site:
+        output = run_then_output([code, site.url + "/item/3.json"])
+
+    assert output == "3\nc\n2\nb\n1\na\nhttp://example.com\n"
+
+
+def test_json_thread_upward_iter():
+    async def collect(url):
+        bcfs = Skrob(
+            "{ id::text; parent %concat('/item/', ., '.json')% -> } !;",
+            url_stream=None,
+        )
+        return [context.text async for context in bcfs.iter([url], max_pending=1)]
+
+    with serve_pages(json_items) as site:
+        assert asyncio.run(collect(site.url + "/item/3.json")) == ["3", "2", "1"]
+
+
 def test_hackernews_json_thread_downward():
     run_then_count(
         [
@@ -121,6 +1014,36 @@ def test_hackernews_json_thread_downward():
     )
 
 
+def test_batch_urls(monkeypatch):
+    with serve_pages(linked_pages) as site:
+        jobs = [
+            {
+                "id": "list",
+                "code": "p::text;",
+                "urls": [site.url + "/0", site.url + "/1"],
+            },
+            {"id": "single", "code": "p::text;", "urls": site.url + "/2"},
+            {"id": "invalid", "code": "p::text;", "urls": 3},
+        ]
+        stdin = "".join(json.dumps(job) + "\n" for job in jobs)
+        monkeypatch.setattr("sys.stdin", StringIO(stdin))
+
+        with StringIO() as output_stream:
+            skrob.cli.run(["skrob", "--batch"], output_stream)
+            lines = [json.loads(line) for line in output_stream.getvalue().splitlines()]
+
+    by_job = {}
+
+    for line in lines:
+        by_job.setdefault(line.pop("id"), []).append(line)
+
+    assert by_job == {
+        "list": [{"text": "Page 0"}, {"text": "Page 1"}, {"done": True, "results": 2}],
+        "single": [{"text": "Page 2"}, {"done": True, "results": 1}],
+        "invalid": [{"error": "TypeError('urls must be a list of URLs, not 3')"}],
+    }
+
+
 def test_discourse_json_thread():
     run_then_count(
         [